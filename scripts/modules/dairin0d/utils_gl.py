@@ -41,7 +41,9 @@ Speed tips:
 
 def initialize():
     import math
-    from collections import namedtuple
+    from collections import namedtuple, OrderedDict
+    
+    import numpy as np
     
     from mathutils import Color, Vector, Matrix, Quaternion, Euler
     
@@ -61,7 +63,13 @@ def initialize():
     
     bgl_names = dir(bgl)
     
-    shader_from_builtin = gpu.shader.from_builtin
+    builtin_shaders = {}
+    def shader_from_builtin(name):
+        shader = builtin_shaders.get(name)
+        if shader is None:
+            shader = gpu.shader.from_builtin(name)
+            builtin_shaders[name] = shader
+        return shader
     
     blf_option_names = ['ROTATION', 'CLIPPING', 'SHADOW', 'KERNING_DEFAULT', 'WORD_WRAP', 'MONOCHROME']
     blf_options = {name : getattr(blf, name) for name in blf_option_names if hasattr(blf, name)}
@@ -82,34 +90,122 @@ def initialize():
     blf_draw = blf.draw
     blf_word_wrap = blf.word_wrap
     
+    # Shadow copy of the GL state, so that nested "with cgl(...)" blocks don't
+    # have to query GL for the values we already know. Since Blender (or blf)
+    # may change GL state behind our back, it's only used within the outermost
+    # "with cgl(...)" block, and can be reset explicitly by cgl.invalidate().
+    shadow = {}
+    shadow_depth = [0]
+    
+    class LazyDescriptor:
+        """
+        A placeholder that creates the actual descriptor on first access
+        (most of the capabilities/states are never used by a given addon)
+        """
+        
+        __slots__ = ("name", "factory", "descriptor")
+        
+        def __init__(self, name, factory):
+            self.name = name
+            self.factory = factory
+            self.descriptor = None
+        
+        def materialize(self):
+            descriptor = self.descriptor
+            if descriptor is None:
+                descriptor = self.factory()
+                self.descriptor = descriptor
+                setattr(CGL, self.name, descriptor)
+            return descriptor
+        
+        def __get__(self, instance, owner):
+            if instance is None: return self
+            return self.materialize().__get__(instance, owner)
+        
+        def __set__(self, instance, value):
+            self.materialize().__set__(instance, value)
+    
+    # Descriptors' __get__/__set__ are cached, so that saving/restoring
+    # the state would bypass the generic attribute lookup machinery
+    state_accessors = {}
+    def get_state_accessors(target, name):
+        accessors = state_accessors.get(name)
+        if accessors is None:
+            descriptor = type(target).__dict__.get(name)
+            if isinstance(descriptor, LazyDescriptor): descriptor = descriptor.materialize()
+            if not hasattr(descriptor, "__set__"):
+                getter = (lambda instance, owner: getattr(instance, name))
+                setter = (lambda instance, value: setattr(instance, name, value))
+                return getter, setter
+            accessors = (descriptor.__get__, descriptor.__set__)
+            state_accessors[name] = accessors
+        return accessors
+    
     class StateRestorator:
-        __slots__ = ("state", "target")
+        __slots__ = ("setters", "values", "target", "active")
         
         def __init__(self, target, args, kwargs):
-            state = {}
+            owner = type(target)
+            setters = []
+            values = []
             for k in args:
-                state[k] = getattr(target, k)
+                getter, setter = get_state_accessors(target, k)
+                setters.append(setter)
+                values.append(getter(target, owner))
             for k, v in kwargs.items():
-                state[k] = getattr(target, k)
-                setattr(target, k, v)
-            self.state = state
+                getter, setter = get_state_accessors(target, k)
+                setters.append(setter)
+                values.append(getter(target, owner))
+                setter(target, v)
+            self.setters = setters
+            self.values = values
             self.target = target
+            self.active = False
         
         def restore(self):
             target = self.target
-            for k, v in self.state.items():
-                setattr(target, k, v)
+            for setter, v in zip(self.setters, self.values):
+                setter(target, v)
         
+        # The shadow copy is only used within 'with' blocks (outside of them,
+        # the GL state may be changed by Blender at any moment)
         def __enter__(self):
+            if shadow_depth[0] == 0: shadow.clear()
+            shadow_depth[0] += 1
+            self.active = True
             return self
         
         def __exit__(self, type, value, traceback):
-            self.restore()
+            try:
+                self.restore()
+            finally:
+                if self.active:
+                    self.active = False
+                    shadow_depth[0] -= 1
+                    if shadow_depth[0] == 0: shadow.clear()
+    
+    # Depth readback usually happens every frame with the same region size,
+    # so buffers are pooled by size instead of being allocated on each call
+    zbuf_pool = {}
+    def get_zbuf(buf_size):
+        zbuf = zbuf_pool.get(buf_size)
+        if zbuf is None:
+            zbuf = Buffer(GL_FLOAT, [buf_size])
+            zbuf_pool[buf_size] = zbuf
+        return zbuf
     
     class CGL:
         def __call__(self, *args, **kwargs):
             return StateRestorator(self, args, kwargs)
         
+        @staticmethod
+        def invalidate():
+            """
+            Forget the known GL state. Call this if GL state was changed directly
+            (e.g. via bgl or blf) within a "with cgl(...)" block.
+            """
+            shadow.clear()
+        
         # Adapted from gpu_extras.batch.batch_for_shader()
         @staticmethod
         def batch(*args, **attr_data):
@@ -122,15 +218,20 @@ def initialize():
             if (arg_count < 2) or (arg_count > 3):
                 raise TypeError(f"batch() takes from 2 to 3 positional arguments but {arg_count} were given")
             
-            vbo_len = 0
-            for data in attr_data.values():
-                if not data: continue
-                data_len = len(data)
-                if data_len == vbo_len: continue
-                if vbo_len == 0:
-                    vbo_len = data_len
-                else:
-                    raise ValueError("Length mismatch for vertex attribute data")
+            if len(attr_data) == 1:
+                # The most common case (e.g. just the positions), nothing to validate
+                for data in attr_data.values():
+                    vbo_len = (len(data) if data else 0)
+            else:
+                vbo_len = 0
+                for data in attr_data.values():
+                    if not data: continue
+                    data_len = len(data)
+                    if data_len == vbo_len: continue
+                    if vbo_len == 0:
+                        vbo_len = data_len
+                    else:
+                        raise ValueError("Length mismatch for vertex attribute data")
             
             vbo_format = args[0]
             if isinstance(vbo_format, str): vbo_format = shader_from_builtin(vbo_format)
@@ -152,6 +253,11 @@ def initialize():
         
         @staticmethod
         def read_zbuffer(xy, wh=(1, 1), centered=False, src=None):
+            """
+            Note: the returned buffer is shared between the calls with the same
+            buffer size, so copy its contents if they need to be retained
+            """
+            
             if isinstance(wh, (int, float)):
                 wh = (wh, wh)
             elif len(wh) < 2:
@@ -167,19 +273,30 @@ def initialize():
             
             if src is None:
                 # xy is in window coordinates!
-                zbuf = Buffer(GL_FLOAT, [buf_size])
+                zbuf = get_zbuf(buf_size)
                 glReadPixels(x, y, w, h, GL_DEPTH_COMPONENT, GL_FLOAT, zbuf)
             else:
                 src, w0, h0 = src
-                template = [0.0] * buf_size
-                for dy in range(h):
-                    y0 = min(max(y + dy, 0), h0-1)
-                    for dx in range(w):
-                        x0 = min(max(x + dx, 0), w0-1)
-                        i0 = x0 + y0 * w0
-                        i1 = dx + dy * w
-                        template[i1] = src[i0]
-                zbuf = Buffer(GL_FLOAT, [buf_size], template)
+                zbuf = get_zbuf(buf_size)
+                if buf_size <= 16:
+                    # For tiny crops, converting the whole source to an array would
+                    # cost more than the loop, so just write into the packed buffer
+                    for dy in range(h):
+                        i0 = min(max(y + dy, 0), h0-1) * w0
+                        i1 = dy * w
+                        for dx in range(w):
+                            zbuf[i1 + dx] = src[i0 + min(max(x + dx, 0), w0-1)]
+                else:
+                    # Only the w*h cropped elements are read from the source
+                    # (converting a whole bgl.Buffer to an array would read
+                    # all of it element by element)
+                    xs = np.clip(np.arange(x, x + w), 0, w0-1)
+                    ys = np.clip(np.arange(y, y + h), 0, h0-1)
+                    indices = (xs[None, :] + ys[:, None] * w0).ravel()
+                    if isinstance(src, np.ndarray):
+                        zbuf[:] = src.reshape(-1)[indices].tolist()
+                    else:
+                        zbuf[:] = [src[i] for i in indices.tolist()]
             
             return zbuf
 
@@ -187,6 +304,13 @@ def initialize():
     
     # ========== TEXT ========== #
     
+    def cached_width(font, text, widths):
+        w = widths.get(text)
+        if w is None:
+            w = blf_dimensions(font, text)[0]
+            widths[text] = w
+        return w
+    
     class TextWrapper:
         # dimensions & wrapping calculation
         @classmethod
@@ -194,47 +318,99 @@ def initialize():
             return blf_dimensions(font, text)
         
         @classmethod
-        def _split_word(cls, width, x, max_x, word, lines, font):
-            line = ""
-            
-            for c in word:
-                x_dx = x + blf_dimensions(font, line+c)[0]
+        def _split_word(cls, width, x, max_x, word, lines, font, widths=None):
+            # Measuring each growing prefix char-by-char is quadratic,
+            # so we guess the split point from the average char width
+            # and then only measure the characters around it
+            if widths is None: widths = {}
+            
+            n = len(word)
+            start = 0
+            
+            while True:
+                avail = width - x
+                w = blf_dimensions(font, word[start:])[0]
+                if (w <= avail) or (start >= n): break
                 
-                if x_dx > width:
-                    x_dx = x + blf_dimensions(font, line)[0]
-                    lines.append(line)
-                    line = c
-                    x = 0
-                else:
-                    line += c
+                j = start + (int((n - start) * avail / w) if avail > 0 else 0)
+                j = min(j, n - 1) # the whole remainder doesn't fit
+                w = blf_dimensions(font, word[start:j])[0]
                 
-                max_x = max(x_dx, max_x)
+                while j < n:
+                    dw = cached_width(font, word[j], widths)
+                    if w + dw > avail: break
+                    w += dw
+                    j += 1
+                
+                while (w > avail) and (j > start):
+                    j -= 1
+                    dw = cached_width(font, word[j], widths)
+                    w -= dw
+                
+                if j > start:
+                    # Kerning can make the sum of per-char widths differ
+                    # from the actual width, so verify the final guess
+                    w = blf_dimensions(font, word[start:j])[0]
+                    while (w > avail) and (j > start):
+                        j -= 1
+                        w = blf_dimensions(font, word[start:j])[0]
+                    while j < n - 1:
+                        w1 = blf_dimensions(font, word[start:j+1])[0]
+                        if w1 > avail: break
+                        w = w1
+                        j += 1
+                
+                if j == start:
+                    if x == 0:
+                        j += 1 # at least one character per line
+                        w = blf_dimensions(font, word[start:j])[0]
+                        if j >= n: break
+                    else:
+                        w = 0
+                
+                lines.append(word[start:j])
+                max_x = max(x + w, max_x)
+                start = j
+                x = 0
             
-            return line, x, max_x
+            max_x = max(x + w, max_x)
+            return word[start:], x, max_x
 
         @classmethod
-        def _split_line(cls, width, x, max_x, line, lines, font):
+        def _split_line(cls, width, x, max_x, line, lines, font, widths=None):
+            if widths is None: widths = {}
+            
+            # Each word is measured only once, and the line width is accumulated
+            # arithmetically (kerning between a space and a glyph is negligible)
+            space_w = cached_width(font, " ", widths)
+            
             words = line.split(" ")
-            line = ""
+            parts = [] # joined only when the line is complete
+            line_w = 0
             
             for word in words:
-                c = (word if not line else " " + word)
-                x_dx = x + blf_dimensions(font, line+c)[0]
+                word_w = cached_width(font, word, widths)
+                c_w = (space_w + word_w if parts else word_w)
+                
+                x_dx = x + line_w + c_w
                 
                 if x_dx > width:
-                    x_dx = x + blf_dimensions(font, line)[0]
-                    if not line:
-                        line, x, max_x = cls._split_word(width, x, max_x, word, lines, font)
+                    x_dx = x + line_w
+                    if not parts:
+                        line, x, max_x = cls._split_word(width, x, max_x, word, lines, font, widths)
                     else:
-                        lines.append(line)
-                        line, x, max_x = cls._split_word(width, 0, max_x, word, lines, font)
+                        lines.append(" ".join(parts))
+                        line, x, max_x = cls._split_word(width, 0, max_x, word, lines, font, widths)
+                    parts = ([line] if line else [])
+                    line_w = blf_dimensions(font, line)[0]
                     x = 0
-                else:
-                    line += c
+                elif parts or word: # leading spaces are skipped
+                    parts.append(word)
+                    line_w += c_w
                 
                 max_x = max(x_dx, max_x)
             
-            if line: lines.append(line)
+            if parts: lines.append(" ".join(parts))
             
             return max_x
 
@@ -242,11 +418,13 @@ def initialize():
         def split_text(cls, width, x, max_x, text, lines, font=0):
             if width is None: width = math.inf
             
+            widths = {} # widths of characters and words, measured on demand
+            
             for line in text.splitlines():
                 if not line:
                     lines.append("")
                 else:
-                    max_x = cls._split_line(width, x, max_x, line, lines, font)
+                    max_x = cls._split_line(width, x, max_x, line, lines, font, widths)
                 x = 0
             
             return max_x
@@ -266,27 +444,32 @@ def initialize():
             
             if width is None: width = math.inf
             
+            widths = {} # widths of characters and words, measured on demand
+            
             lines = []
             max_x = 0
             for line in text.splitlines():
                 if not line:
                     lines.append("")
                 else:
-                    max_x = cls._split_line(width, indent, max_x, line, lines, font)
+                    max_x = cls._split_line(width, indent, max_x, line, lines, font, widths)
             
             line_height = blf_dimensions(font, "Ig")[1]
             
             return lines, (max_x, len(lines)*line_height)
     
     class BatchedText:
-        __slots__ = ("font", "pieces", "size")
+        __slots__ = ("font", "texts", "xs", "ys", "size")
         
-        def __init__(self, font, pieces, size):
+        def __init__(self, font, texts, xs, ys, size):
             self.font = font
-            self.pieces = pieces
+            self.texts = texts
+            self.xs = xs
+            self.ys = ys
             self.size = size
         
-        def draw(self, pos, origin=None):
+        def draw(self, pos, origin=None, blf_position=blf_position, blf_draw=blf_draw):
+            # blf functions are bound as defaults to be accessed as fast locals
             x = pos[0]
             y = pos[1]
             z = (pos[2] if len(pos) > 2 else 0)
@@ -303,8 +486,8 @@ def initialize():
             
             font = self.font
             x0, y0 = round(x), round(y)
-            for txt, x, y in self.pieces:
-                blf_position(font, x0+x, y0+y, z)
+            for txt, dx, dy in zip(self.texts, self.xs, self.ys):
+                blf_position(font, x0+dx, y0+dy, z)
                 blf_draw(font, txt)
             
             # Note: blf_draw() resets GL_BLEND (and GL_POLYGON_SMOOTH
@@ -316,10 +499,17 @@ def initialize():
     class Text:
         font = 0 # 0 is the default font
         
+        compiled_max = 64 # how many compiled texts to keep for draw()
+        
+        def __init__(self):
+            self.compiled = OrderedDict()
+            self.generation = 0 # incremented when text metrics may change
+        
         # load / unload
         def load(self, filename, size=None, dpi=72):
             font = blf_load(filename)
             if size is not None: blf_size(font, int(size), dpi)
+            self.generation += 1
             return font
         def unload(self, filename):
             blf_unload(filename)
@@ -328,9 +518,11 @@ def initialize():
         def enable(self, option):
             if option not in blf_options: return
             blf_enable(self.font, blf_options[option])
+            self.generation += 1
         def disable(self, option):
             if option not in blf_options: return
             blf_disable(self.font, blf_options[option])
+            self.generation += 1
         
         # set shadow
         def shadow(self, level, r, g, b, a):
@@ -345,14 +537,17 @@ def initialize():
             blf_rotation(self.font, angle)
         def size(self, size, dpi=72):
             blf_size(self.font, int(size), dpi)
+            self.generation += 1
         def color(self, r, g, b, a=1.0):
             blf_color(self.font, r, g, b, a)
         
         # set clipping / aspect
         def clipping(self, xmin, ymin, xmax, ymax):
             blf_clipping(self.font, xmin, ymin, xmax, ymax)
+            self.generation += 1
         def aspect(self, aspect):
             blf_aspect(self.font, aspect)
+            self.generation += 1
         
         def compile(self, text, width=None, alignment=None, spacing=1.0):
             font = self.font
@@ -365,7 +560,7 @@ def initialize():
             w, h = size[0], size[1] * abs(spacing)
             
             size = (w, h)
-            pieces = []
+            texts, xs, ys = [], [], []
             
             if (alignment in (None, 'LEFT')): alignment = 0.0
             elif (alignment == 'CENTER'): alignment = 0.5
@@ -381,18 +576,36 @@ def initialize():
             x, y = 0, 0
             for line in lines:
                 x = (w - blf_dimensions(font, line)[0]) * alignment
-                pieces.append((line, round(x), round(y)))
+                texts.append(line)
+                xs.append(round(x))
+                ys.append(round(y))
                 y += y_step
             
-            return BatchedText(font, pieces, size)
+            return BatchedText(font, texts, xs, ys, size)
         
         def draw(self, text, pos=None, origin=None, width=None, alignment=None, spacing=1.0):
             if pos is None:
                 # if position is not specified, other calculations cannot be performed
                 blf_draw(self.font, text)
+                # blf_draw() resets GL_BLEND (and GL_POLYGON_SMOOTH since 2.91)
+                shadow.pop("BLEND", None)
+                shadow.pop("POLYGON_SMOOTH", None)
                 return None
             
-            batched = self.compile(text, width, alignment, spacing)
+            # Static overlays usually redraw the same text every frame, so the
+            # layout is reused. The dimensions of a reference string are a part
+            # of the key to detect blf.size() etc. called outside of this class.
+            font = self.font
+            key = (font, text, width, alignment, spacing, self.generation, blf_dimensions(font, "Ig"))
+            compiled = self.compiled
+            batched = compiled.get(key)
+            if batched is None:
+                batched = self.compile(text, width, alignment, spacing)
+                compiled[key] = batched
+                if len(compiled) > self.compiled_max: compiled.popitem(last=False)
+            else:
+                compiled.move_to_end(key)
+            
             batched.draw(pos, origin)
             return batched
     
@@ -400,6 +613,18 @@ def initialize():
     
     # ========== GL API ========== #
     
+    cap_template = '''
+def __get__(self, instance, owner, glIsEnabled=glIsEnabled, shadow=shadow, shadow_depth=shadow_depth):
+    value = shadow.get({name!r})
+    if value is None:
+        value = bool(glIsEnabled({state_id}))
+        if shadow_depth[0]: shadow[{name!r}] = value
+    return value
+def __set__(self, instance, value, glEnable=glEnable, glDisable=glDisable, shadow=shadow, shadow_depth=shadow_depth):
+    (glEnable if value else glDisable)({state_id})
+    if shadow_depth[0]: shadow[{name!r}] = bool(value)
+'''
+    
     def Cap(name, doc=""):
         pname = name[3:]
         if hasattr(CGL, pname): return
@@ -407,22 +632,39 @@ def initialize():
         state_id = getattr(bgl, name, None)
         if state_id is None: return
         
-        class Descriptor:
-            __doc__ = doc
-            def __get__(self, instance, owner):
-                return bool(glIsEnabled(state_id))
-            def __set__(self, instance, value):
-                (glEnable if value else glDisable)(state_id)
+        def factory():
+            # state_id is baked into the bytecode as a constant,
+            # and GL functions are bound as fast local defaults
+            namespace = {"glIsEnabled":glIsEnabled, "glEnable":glEnable, "glDisable":glDisable,
+                "shadow":shadow, "shadow_depth":shadow_depth}
+            exec(cap_template.format(name=pname, state_id=int(state_id)), namespace)
+            
+            Descriptor = type(pname+"_Descriptor", (), {"__doc__":doc,
+                "__get__":namespace["__get__"], "__set__":namespace["__set__"]})
+            return Descriptor()
         
-        setattr(CGL, pname, Descriptor())
+        setattr(CGL, pname, LazyDescriptor(pname, factory))
     
     def add_descriptor(name, getter, setter, doc=""):
-        #Descriptor = type(name+"_Descriptor", (), {"__doc__":doc, "__get__":getter, "__set__":setter})
-        class Descriptor:
-            __doc__ = doc
-            __get__ = getter
-            __set__ = setter
-        setattr(CGL, name, Descriptor())
+        def factory():
+            #Descriptor = type(name+"_Descriptor", (), {"__doc__":doc, "__get__":getter, "__set__":setter})
+            class Descriptor:
+                __doc__ = doc
+                def __get__(self, instance, owner):
+                    value = shadow.get(name)
+                    if value is None:
+                        value = getter(self, instance, owner)
+                        if shadow_depth[0]: shadow[name] = value
+                    return value
+                def __set__(self, instance, value):
+                    setter(self, instance, value)
+                    # The assigned value may be of a different type
+                    # (e.g. a list instead of a namedtuple), so the
+                    # actual state will be queried on the next read
+                    shadow.pop(name, None)
+            return Descriptor()
+        
+        setattr(CGL, name, LazyDescriptor(name, factory))
     
     def map_enum(*names):
         enum_k2v = {}
@@ -471,9 +713,8 @@ def initialize():
     Cap('GL_TEXTURE_CUBE_MAP_SEAMLESS')
     Cap('GL_PROGRAM_POINT_SIZE') # old name: GL_VERTEX_PROGRAM_POINT_SIZE
     
-    range4 = tuple(range(4))
     def matrix_to_buffer(matrix, dtype=GL_FLOAT):
-        return Buffer(dtype, 16, [matrix[i][j] for i in range4 for j in range4])
+        return Buffer(dtype, 16, [v for row in matrix for v in row])
     def buffer_to_matrix(buf):
         return Matrix((buf[0:4], buf[4:8], buf[8:12], buf[12:16]))
     
@@ -619,9 +860,9 @@ def initialize():
         from bgl import GL_POLYGON_OFFSET_FACTOR, GL_POLYGON_OFFSET_UNITS, glPolygonOffset
         PolygonOffset = namedtuple("PolygonOffset", ("factor", "units"))
         def _get(self, instance, owner):
-            glGetFloatv(GL_POLYGON_OFFSET_FACTOR, float2buf0)
-            glGetFloatv(GL_POLYGON_OFFSET_UNITS, float2buf1)
-            return PolygonOffset(float2buf0[0], float2buf1[0])
+            glGetFloatv(GL_POLYGON_OFFSET_FACTOR, float1buf0)
+            glGetFloatv(GL_POLYGON_OFFSET_UNITS, float1buf1)
+            return PolygonOffset(float1buf0[0], float1buf1[0])
         def _set(self, instance, value):
             glPolygonOffset(float(value[0]), float(value[1]))
         add_descriptor("PolygonOffset", _get, _set)
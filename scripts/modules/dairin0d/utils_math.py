@@ -21,6 +21,8 @@ from mathutils import Color, Vector, Matrix, Quaternion, Euler
 import math
 import itertools
 
+import numpy as np
+
 #============================================================================#
 
 def _range_count(size, step):
@@ -90,9 +92,10 @@ def divide():
 divide = divide()
 
 def product():
+    if hasattr(math, "prod"): return math.prod # Python 3.8+
     from functools import reduce
     from operator import mul
-    def product(iterable, start=1):
+    def product(iterable, *, start=1):
         return reduce(mul, iterable, start)
     return product
 product = product()
@@ -109,14 +112,23 @@ def binomial(n, k): # A fast way to calculate binomial coefficients by Andrew Da
         ktok *= t
         n -= 1
     return ntok // ktok
+if hasattr(math, "comb"): # Python 3.8+
+    def binomial(n, k, comb=math.comb, binomial_loop=binomial):
+        if not (0 <= k <= n): return 0
+        try:
+            return comb(n, k)
+        except TypeError: # comb() only takes ints (e.g. n can be 4.0)
+            return binomial_loop(n, k)
 
 def lerp(v0, v1, t):
     return v0 * (1.0 - t) + v1 * t
 
 def clamp(v, v_min, v_max):
-    # For NaN, min/max return the first argument
+    # Same as min(v_max, max(v_min, v)), without the builtin calls
+    # (NaN fails both comparisons, so it gets clamped to v_min).
     # Here, we assume that min and max are not NaN
-    return min(v_max, max(v_min, v))
+    v = (v if v > v_min else v_min)
+    return (v if v < v_max else v_max)
 
 def nan_min(*args, default=None):
     from math import isnan
@@ -136,9 +148,9 @@ def replace_nan(vec, default):
         return [(default if isnan(v) else v) for v in vec]
     return [(d if isnan(v) else v) for v, d in zip(vec, default)]
 
-def round_step(x, s=1.0):
-    #return math.floor(x * s + 0.5) / s
-    return math.floor(x / s + 0.5) * s
+def round_step(x, s=1.0, floor=math.floor):
+    #return floor(x * s + 0.5) / s
+    return floor(x / s + 0.5) * s
 
 def clamp_angle(ang, pi=math.pi):
     # Attention! In Python the behaviour is:
@@ -148,10 +160,10 @@ def clamp_angle(ang, pi=math.pi):
     ang = (ang % twoPi)
     return ((ang - twoPi) if (ang > pi) else ang)
 
-def angle_signed(n, v0, v1, fallback=None):
+def angle_signed(n, v0, v1, fallback=None, copysign=math.copysign):
     angle = v0.angle(v1, fallback)
     if (angle != fallback) and (angle > 0):
-        angle *= math.copysign(1.0, v0.cross(v1).dot(n))
+        angle *= copysign(1.0, v0.cross(v1).dot(n))
     return angle
 
 def snap_pixel_vector(v, d=0.5): # to have 2d-stable 3d drawings
@@ -161,27 +173,27 @@ def nautical_euler_from_axes(forward, right):
     x = Vector(right)
     y = Vector(forward)
     
-    world_x = Vector((1, 0, 0))
-    world_z = Vector((0, 0, 1))
-    
     if abs(y.z) > (1 - 1e-12): # sufficiently close to vertical
         roll = 0.0
         xdir = x.copy()
     else:
-        xdir = y.cross(world_z)
-        rollPos = angle_signed(-y, x, xdir, 0.0)
-        rollNeg = angle_signed(-y, x, -xdir, 0.0)
-        if abs(rollNeg) < abs(rollPos):
-            roll = rollNeg
+        xdir = y.cross(Vector((0, 0, 1)))
+        roll = angle_signed(-y, x, xdir, 0.0)
+        # The angle to -xdir is (pi - angle to xdir), with the opposite sign
+        if abs(roll) > math.pi * 0.5:
+            roll -= math.copysign(math.pi, roll)
             xdir = -xdir
-        else:
-            roll = rollPos
-    xdir = Vector((xdir.x, xdir.y, 0)).normalized()
     
-    yaw = angle_signed(-world_z, xdir, world_x, 0.0)
+    # With xdir flattened to the XY plane, the angles to world X and Z axes
+    # reduce to atan2 of the vector components
+    xdir_x, xdir_y = xdir.x, xdir.y
+    xdir_len = math.hypot(xdir_x, xdir_y)
+    if xdir_len == 0.0: return Euler((0.0, roll, 0.0), 'YXZ')
+    xdir_x /= xdir_len
+    xdir_y /= xdir_len
     
-    zdir = xdir.cross(y).normalized()
-    pitch = angle_signed(-xdir, zdir, world_z, 0.0)
+    yaw = math.atan2(xdir_y, xdir_x)
+    pitch = math.atan2(y.z, xdir_x * y.y - xdir_y * y.x)
     
     return Euler((pitch, roll, yaw), 'YXZ')
 
@@ -203,8 +215,7 @@ def line_line_t(line, line1, fallback=None, normalized=True, clip0=None, clip1=N
     if not res: return fallback
     delta = v01 - v00
     mag2 = delta.length_squared
-    delta *= 1.0/mag2
-    t = (res[0] - v00).dot(delta) # res is tuple of vectors
+    t = (res[0] - v00).dot(delta) / mag2 # res is tuple of vectors
     if clip0 is not None: t = max(t, clip0)
     if clip1 is not None: t = min(t, clip1)
     if not normalized: t *= math.sqrt(mag2)
@@ -216,8 +227,7 @@ def line_plane_t(line, plane, fallback=None, normalized=True, clip0=None, clip1=
     if not res: return fallback
     delta = v01 - v00
     mag2 = delta.length_squared
-    delta *= 1.0/mag2
-    t = (res - v00).dot(delta) # res is vector
+    t = (res - v00).dot(delta) / mag2 # res is vector
     if clip0 is not None: t = max(t, clip0)
     if clip1 is not None: t = min(t, clip1)
     if not normalized: t *= math.sqrt(mag2)
@@ -231,9 +241,9 @@ def line_sphere_t(line, sphere, fallback=None, normalized=True, clip0=None, clip
     if (not pA) or (not pB): return fallback
     delta = v01 - v00
     mag2 = delta.length_squared
-    delta *= 1.0/mag2
-    tA = (pA - v00).dot(delta)
-    tB = (pB - v00).dot(delta)
+    inv_mag2 = 1.0/mag2
+    tA = (pA - v00).dot(delta) * inv_mag2
+    tB = (pB - v00).dot(delta) * inv_mag2
     if clip0 is not None:
         tA = max(tA, clip0)
         tB = max(tB, clip0)
@@ -241,30 +251,111 @@ def line_sphere_t(line, sphere, fallback=None, normalized=True, clip0=None, clip
         tA = min(tA, clip1)
         tB = min(tB, clip1)
     if not normalized:
-        tA *= math.sqrt(mag2)
-        tB *= math.sqrt(mag2)
+        mag = math.sqrt(mag2)
+        tA *= mag
+        tB *= mag
     return (tA, tB)
 
-def line_box_t_inv(origin, inv_dir, box_min, box_max, fallback=None):
+def _line_box_t_inv3(origin, inv_dir, box_min, box_max, fallback=None):
+    # Unrolled 3D slab test (the common case); NaN comparisons are
+    # always False, so NaN slabs are skipped like in the generic version
+    ox, oy, oz = origin
+    ix, iy, iz = inv_dir
+    min_x, min_y, min_z = box_min
+    max_x, max_y, max_z = box_max
+    
     tmin, tmax = 0.0, 1.0
-    for vmin, vmax, v_origin, v_inv_dir in zip(box_min, box_max, origin, inv_dir):
-        if v_inv_dir < 0.0:
-            t0 = (vmax - v_origin) * v_inv_dir
-            t1 = (vmin - v_origin) * v_inv_dir
-        else:
-            t0 = (vmin - v_origin) * v_inv_dir
-            t1 = (vmax - v_origin) * v_inv_dir
-        tmin = max(tmin, t0)
-        tmax = min(tmax, t1)
-        if tmax <= tmin: return fallback
+    
+    t0, t1 = (min_x - ox) * ix, (max_x - ox) * ix
+    if ix < 0.0: t0, t1 = t1, t0
+    if t0 > tmin: tmin = t0
+    if t1 < tmax: tmax = t1
+    if tmax <= tmin: return fallback
+    
+    t0, t1 = (min_y - oy) * iy, (max_y - oy) * iy
+    if iy < 0.0: t0, t1 = t1, t0
+    if t0 > tmin: tmin = t0
+    if t1 < tmax: tmax = t1
+    if tmax <= tmin: return fallback
+    
+    t0, t1 = (min_z - oz) * iz, (max_z - oz) * iz
+    if iz < 0.0: t0, t1 = t1, t0
+    if t0 > tmin: tmin = t0
+    if t1 < tmax: tmax = t1
+    if tmax <= tmin: return fallback
+    
+    return (tmin, tmax)
+
+def line_box_t_inv(origin, inv_dir, box_min, box_max, fallback=None):
+    if len(origin) == 3:
+        return _line_box_t_inv3(origin, inv_dir, box_min, box_max, fallback)
+    
+    # Branchless slab test. NaNs (from 0 * inf) are skipped by fmax/fmin,
+    # same as they would be by the builtin max()/min().
+    origin = np.asarray(origin, dtype=np.float64)
+    inv_dir = np.asarray(inv_dir, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        t_min = (np.asarray(box_min, dtype=np.float64) - origin) * inv_dir
+        t_max = (np.asarray(box_max, dtype=np.float64) - origin) * inv_dir
+    negative = (inv_dir < 0.0)
+    t0 = np.where(negative, t_max, t_min)
+    t1 = np.where(negative, t_min, t_max)
+    tmin = max(0.0, float(np.fmax.reduce(t0)))
+    tmax = min(1.0, float(np.fmin.reduce(t1)))
+    if tmax <= tmin: return fallback
     return (tmin, tmax)
 
+def line_box_t_batch(origins, inv_dirs, box_min, box_max):
+    # Vectorized slab test for N rays (origins and inv_dirs are (N, dims))
+    # against a single box; returns (tmin, tmax, hit) arrays of shape (N,)
+    origins = np.asarray(origins, dtype=np.float64)
+    inv_dirs = np.asarray(inv_dirs, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        t_min = (np.asarray(box_min, dtype=np.float64) - origins) * inv_dirs
+        t_max = (np.asarray(box_max, dtype=np.float64) - origins) * inv_dirs
+    negative = (inv_dirs < 0.0)
+    t0 = np.where(negative, t_max, t_min)
+    t1 = np.where(negative, t_min, t_max)
+    tmin = np.fmax(0.0, np.fmax.reduce(t0, axis=1))
+    tmax = np.fmin(1.0, np.fmin.reduce(t1, axis=1))
+    return tmin, tmax, (tmax > tmin)
+
 def line_box_t(line, box, fallback=None):
     v00, v01 = line
     delta = v01 - v00
-    inv_dir = [divide(1.0, v) for v in delta]
+    if len(delta) == 3:
+        inv_dir = [divide(1.0, v) for v in delta]
+    else:
+        with np.errstate(divide='ignore'):
+            inv_dir = np.reciprocal(np.asarray(delta, dtype=np.float64))
     return line_box_t_inv(v00, inv_dir, box[0], box[1], fallback)
 
+def _clip_polygon_np(primitive, plane):
+    # Vectorized Sutherland-Hodgman (the Vector <-> array conversion
+    # only pays off for polygons with many vertices)
+    verts = np.array(primitive, dtype=np.float64)
+    plane_no = np.array(plane[1], dtype=np.float64)
+    dists = (verts - np.array(plane[0], dtype=np.float64)) @ plane_no
+    inside = (dists >= 0)
+    
+    verts1 = np.roll(verts, -1, axis=0)
+    dists1 = np.roll(dists, -1)
+    crossing = (inside != np.roll(inside, -1))
+    
+    # For each edge, emit the start vertex (if inside) followed by
+    # the crossing point (if any); row-major masking keeps the order
+    denom = np.where(crossing, dists - dists1, 1.0)
+    t = np.where(crossing, dists / denom, 0.0)
+    points = np.stack((verts, verts + (verts1 - verts) * t[:, None]), axis=1)
+    res = points[np.stack((inside, crossing), axis=1)]
+    
+    if len(res) > 1:
+        keep = np.ones(len(res), dtype=bool)
+        keep[1:] = np.any(res[1:] != res[:-1], axis=1)
+        res = res[keep]
+    
+    return [Vector(v) for v in res.tolist()]
+
 def clip_primitive(primitive, plane): # expected to be a list of vertices
     primitive_size = len(primitive)
     if primitive_size == 0:
@@ -282,15 +373,24 @@ def clip_primitive(primitive, plane): # expected to be a list of vertices
         delta = primitive[1] - primitive[0]
         if dist1 < dist0: return [primitive[0], primitive[0] + delta * t]
         return [primitive[0] + delta * t, primitive[1]]
+    elif primitive_size >= 16:
+        return _clip_polygon_np(primitive, plane)
     else: # should be convex and planar?
+        # Sutherland-Hodgman, with plane distances computed once per vertex
+        plane_co, plane_no = plane
+        distance_point_to_plane = mathutils.geometry.distance_point_to_plane
+        dists = [distance_point_to_plane(v, plane_co, plane_no) for v in primitive]
         res = []
+        v1, dist1 = primitive[0], dists[0]
         for i in range(primitive_size):
-            v0 = primitive[i]
-            v1 = primitive[(i+1) % primitive_size]
-            segment = clip_primitive([v0, v1], plane)
-            if not segment: continue
-            if (len(res) == 0) or (res[-1] != segment[0]): res.append(segment[0])
-            if (i < primitive_size-1): res.append(segment[1])
+            v0, dist0 = v1, dist1
+            j = (i+1) % primitive_size
+            v1, dist1 = primitive[j], dists[j]
+            inside0 = (dist0 >= 0)
+            if inside0 and ((not res) or (res[-1] != v0)): res.append(v0)
+            if inside0 != (dist1 >= 0):
+                v = v0 + (v1 - v0) * (dist0 / (dist0 - dist1))
+                if (not res) or (res[-1] != v): res.append(v)
         return res
 
 def transform_point_normal(m, t, n, as_plane=True):
@@ -306,15 +406,14 @@ def transform_point_normal(m, t, n, as_plane=True):
 def transform_plane(m, x, y, z, t):
     if (x is None) or (y is None): x, y, z = orthogonal_XYZ(x, y, z, "z")
     
-    p0 = Vector(t)
-    px = p0 + Vector(x)
-    py = p0 + Vector(y)
-    pz = p0 + Vector(z)
+    # z is recalculated from x and y, so it doesn't need to be transformed
+    p0 = (t if isinstance(t, Vector) else Vector(t))
+    px = p0 + (x if isinstance(x, Vector) else Vector(x))
+    py = p0 + (y if isinstance(y, Vector) else Vector(y))
     
     p0 = m @ p0
     px = m @ px
     py = m @ py
-    pz = m @ pz
     
     t = p0
     y = (py - p0).normalized()
@@ -371,32 +470,30 @@ def orthogonal(v, never_zero=False):
     return (ort if ort.length_squared > 0.5 else Vector((1,0,0)))
 
 def matrix_flatten(m):
-    return tuple(itertools.chain(*m.col))
+    c = m.col
+    if len(c) == 4: return (*c[0], *c[1], *c[2], *c[3])
+    return tuple(itertools.chain.from_iterable(c))
 
 def matrix_unflatten(array):
+    # Matrix() takes rows, and array is column-major. Explicit indexing
+    # is used because bpy_prop_array doesn't support stepped slices.
     size = len(array)
+    a = array
     if size == 16:
-        m = Matrix.Identity(4)
-        m.col[0] = array[0:4]
-        m.col[1] = array[4:8]
-        m.col[2] = array[8:12]
-        m.col[3] = array[12:16]
+        m = Matrix(((a[0], a[4], a[8], a[12]), (a[1], a[5], a[9], a[13]),
+            (a[2], a[6], a[10], a[14]), (a[3], a[7], a[11], a[15])))
     elif size == 9:
-        m = Matrix.Identity(3)
-        m.col[0] = array[0:3]
-        m.col[1] = array[3:6]
-        m.col[2] = array[6:9]
+        m = Matrix(((a[0], a[3], a[6]), (a[1], a[4], a[7]), (a[2], a[5], a[8])))
     elif size == 4:
-        m = Matrix.Identity(2)
-        m.col[0] = array[0:2]
-        m.col[1] = array[2:4]
+        m = Matrix(((a[0], a[2]), (a[1], a[3])))
     return m
 
 def matrix_LRS(L, R, S):
     m = R.to_matrix()
-    m.col[0] *= S[0]
-    m.col[1] *= S[1]
-    m.col[2] *= S[2]
+    axes = m.col
+    axes[0] *= S[0]
+    axes[1] *= S[1]
+    axes[2] *= S[2]
     m.resize_4x4()
     m.translation = L
     return m
@@ -413,31 +510,21 @@ def matrix_compose(*args):
     m = Matrix.Identity(size)
     axes = m.col
     
-    if size == 2:
-        for i in (0, 1):
-            c = args[i]
-            if isinstance(c, Vector):
-                axes[i] = c.to_2d()
-            elif hasattr(c, "__iter__"):
-                axes[i] = Vector(c).to_2d()
-            else:
-                axes[i][i] = c
-    else:
-        for i in (0, 1, 2):
-            c = args[i]
-            if isinstance(c, Vector):
-                axes[i][:3] = c.to_3d()
-            elif hasattr(c, "__iter__"):
-                axes[i][:3] = Vector(c).to_3d()
-            else:
-                axes[i][i] = c
-        
-        if size == 4:
-            c = args[3]
-            if isinstance(c, Vector):
-                m.translation = c.to_3d()
-            elif hasattr(c, "__iter__"):
-                m.translation = Vector(c).to_3d()
+    dims = (2 if size == 2 else 3)
+    for i in range(dims):
+        c = args[i]
+        if isinstance(c, (int, float)) or not (isinstance(c, Vector) or hasattr(c, "__iter__")):
+            axes[i][i] = c
+        else:
+            if not isinstance(c, Vector): c = Vector(c)
+            axes[i][:dims] = (c.to_2d() if dims == 2 else c.to_3d())
+    
+    if size == 4:
+        c = args[3]
+        if isinstance(c, Vector):
+            m.translation = c.to_3d()
+        elif hasattr(c, "__iter__"):
+            m.translation = Vector(c).to_3d()
     
     return m
 
@@ -463,10 +550,11 @@ def matrix_invert_safe(m):
         return
     except ValueError:
         pass
-    m.col[0][0] += 1e-6
-    m.col[1][1] += 1e-6
-    m.col[2][2] += 1e-6
-    m.col[3][3] += 1e-6
+    axes = m.col
+    axes[0][0] += 1e-6
+    axes[1][1] += 1e-6
+    axes[2][2] += 1e-6
+    axes[3][3] += 1e-6
     try:
         m.invert()
     except ValueError:
@@ -477,10 +565,11 @@ def matrix_inverted_safe(m):
     except ValueError:
         pass
     m = Matrix()
-    m.col[0][0] += 1e-6
-    m.col[1][1] += 1e-6
-    m.col[2][2] += 1e-6
-    m.col[3][3] += 1e-6
+    axes = m.col
+    axes[0][0] += 1e-6
+    axes[1][1] += 1e-6
+    axes[2][2] += 1e-6
+    axes[3][3] += 1e-6
     try:
         return m.inverted()
     except ValueError:
@@ -23,6 +23,8 @@ import shutil
 import datetime
 import time
 import inspect
+import sys
+import bisect
 
 #============================================================================#
 
@@ -73,9 +75,32 @@ def setitem_cmp(obj, key, value, epsilon=None):
 
 def bools_to_int(bools):
     # https://stackoverflow.com/questions/4065737/python-numpy-convert-list-of-bools-to-unsigned-int
-    return sum((1 << i) for i, b in enumerate(bools) if b)
+    if (not hasattr(bools, "__len__")) or (len(bools) < 16):
+        return sum((1 << i) for i, b in enumerate(bools) if b)
+    
+    # For longer sequences, let numpy pack the bits. Reversed order +
+    # big-endian packing is used since packbits(bitorder=) needs numpy 1.17+
+    import numpy as np
+    bits = np.asarray(bools, dtype=bool)[::-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big") >> ((-len(bits)) % 8)
+
+_bisect_has_key = (sys.version_info >= (3, 10))
 
 def binary_search(seq, entry, key=None, cmp=None, lo=0, hi=-1, insert=None): # bisect module doesn't support key/compare callbacks
+    if (not cmp) and ((not key) or _bisect_has_key):
+        # Fast path: let the C implementation of bisect do the search
+        if lo < 0: lo += len(seq)
+        if hi < 0: hi += len(seq)
+        q = (key(entry) if key else entry)
+        bisect_func = (bisect.bisect_right if isinstance(insert, int) and (insert > 0) else bisect.bisect_left)
+        if key:
+            i = bisect_func(seq, q, lo, max(lo, hi+1), key=key)
+        else:
+            i = bisect_func(seq, q, lo, max(lo, hi+1))
+        if insert or (insert == 0): return i
+        found = (i <= hi) and not (q < (key(seq[i]) if key else seq[i]))
+        return (i if found else -(i+1))
+    
     if cmp:
         q, _key = 0, (lambda i: cmp(seq[i], entry))
     elif key:
@@ -165,23 +190,35 @@ def add_mixins(cls, *mixins, inherited=True):
     
     return cls
 
+# Tuple comparison does the element-wise loop in C
 def sequence_compare(seqA, seqB):
     if len(seqA) != len(seqB): return False
-    return all(seqA[i] == seqB[i] for i in range(len(seqA)))
+    return tuple(seqA) == tuple(seqB)
 
 def sequence_startswith(a, b):
     na = len(a); nb = len(b)
     if nb > na: return False
-    return all(a[i] == b[i] for i in range(nb))
+    try:
+        return tuple(a[:nb]) == tuple(b)
+    except TypeError: # not sliceable
+        return all(a[i] == b[i] for i in range(nb))
 
 def sequence_endswith(a, b):
     na = len(a); nb = len(b)
     if nb > na: return False
-    return all(a[na-i] == b[nb-i] for i in range(1, nb+1))
+    try:
+        return tuple(a[na-nb:]) == tuple(b)
+    except TypeError: # not sliceable
+        return all(a[na-i] == b[nb-i] for i in range(1, nb+1))
 
 # Primary function of such objects is to store
 # attributes and values assigned to an instance
 class AttributeHolder:
+    # The internal fields are slots, so they are found by type lookup and
+    # don't clutter the instance dict (which is still needed for the
+    # arbitrary attributes)
+    __slots__ = ("__dict__", "__original", "__items")
+    
     def __init__(self, *args, **kwargs):
         self.__original = (args[0] if args else None)
         for k, v in kwargs.items():
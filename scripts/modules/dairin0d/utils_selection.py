@@ -16,15 +16,126 @@
 #  ***** END GPL LICENSE BLOCK *****
 
 import time
+import itertools
+
+import numpy as np
 
 import bpy
 import bmesh
 
-import mathutils
-from mathutils import Color, Vector, Euler, Quaternion, Matrix
-
 from .bpy_inspect import BlEnums
 
+def foreach_get_bools(items, attr):
+    # One bulk read instead of an RNA attribute access per element
+    values = np.empty(len(items), dtype=bool)
+    items.foreach_get(attr, values)
+    return values.tolist()
+
+def foreach_get_flags(items, attrs):
+    # Packs several bool attributes into one integer code per element
+    # (bit i corresponds to attrs[i])
+    codes = np.zeros(len(items), dtype=np.uint8)
+    values = np.empty(len(items), dtype=bool)
+    for bit, attr in enumerate(attrs):
+        items.foreach_get(attr, values)
+        codes[values] |= (1 << bit)
+    return codes.tolist()
+
+def foreach_any(items, *attrs):
+    # True if any of the given bool attributes is set on any element
+    count = len(items)
+    if count == 0: return False
+    values = np.empty(count, dtype=bool)
+    for attr in attrs:
+        items.foreach_get(attr, values)
+        if values.any(): return True
+    return False
+
+# Only maps of immutable containers are cached: callers may modify the
+# yielded containers, so mutable ones are built anew for each walk
+_immutable_containers = (tuple, frozenset)
+
+# (container, names) -> {(bool, bool, bool): container of the names with True flags}
+_flags_sel_maps = {}
+
+def flags_sel_map(container, names):
+    key = (container, names)
+    sel_map = _flags_sel_maps.get(key)
+    if sel_map is None:
+        sel_map = {flags: container(tuple(name for name, flag in zip(names, flags) if flag))
+            for flags in itertools.product((False, True), repeat=len(names))}
+        if container in _immutable_containers: _flags_sel_maps[key] = sel_map
+    return sel_map
+
+# container -> {False: empty container, True: container(("select",))}
+_select_sel_maps = {}
+
+def select_sel_map(container):
+    sel_map = _select_sel_maps.get(container)
+    if sel_map is None:
+        sel_map = {False: container(), True: container(("select",))}
+        if container in _immutable_containers: _select_sel_maps[container] = sel_map
+    return sel_map
+
+def flags_sel_table(container, names):
+    # Same as flags_sel_map(), but indexed by the codes from foreach_get_flags()
+    sel_map = flags_sel_map(container, names)
+    bits = range(len(names))
+    return [sel_map[tuple(bool(code & (1 << bit)) for bit in bits)] for code in range(1 << len(names))]
+
+def foreach_update_bools(items, attr, new, expr_info):
+    # Vectorized equivalent of the generated brute-force selector:
+    # one bulk read, numpy bool ops, one bulk write
+    count = len(items)
+    if count == 0: return
+    
+    operation, new_toggled, invert_new, old_toggled, invert_old = expr_info
+    
+    if new_toggled is not None:
+        new = new_toggled
+    elif invert_new:
+        new = np.logical_not(new)
+    
+    if operation == 'SET':
+        result = new
+    else:
+        if old_toggled is not None:
+            old = old_toggled
+        else:
+            old = np.empty(count, dtype=bool)
+            items.foreach_get(attr, old)
+            if invert_old: np.logical_not(old, out=old)
+        
+        if operation == 'OR':
+            result = np.logical_or(old, new)
+        elif operation == 'AND':
+            result = np.logical_and(old, new)
+        else: # XOR
+            result = np.not_equal(old, new)
+    
+    values = np.empty(count, dtype=bool)
+    values[:] = result
+    items.foreach_set(attr, values)
+
+# operation string -> (operation, toggle_old, invert_old, toggle_new, invert_new)
+_update_operations = {}
+
+def parse_update_operation(operation):
+    op_info = _update_operations.get(operation)
+    if op_info is None:
+        toggle_old = operation.startswith("^")
+        invert_old = operation.startswith("!")
+        toggle_new = operation.endswith("^")
+        invert_new = operation.endswith("!")
+        base_operation = operation.replace("!", "").replace("^", "")
+        
+        if base_operation not in {'SET', 'OR', 'AND', 'XOR'}:
+            raise ValueError("operation must be one of {'SET', 'OR', 'AND', 'XOR'}")
+        
+        op_info = (base_operation, toggle_old, invert_old, toggle_new, invert_new)
+        _update_operations[operation] = op_info
+    return op_info
+
 class Selection:
     def __init__(self, context=None, mode=None, elem_types=None, container=set, brute_force_update=False, pose_bones=True, copy_bmesh=False):
         self.context = context
@@ -37,8 +148,29 @@ class Selection:
         self.container = container
         # We MUST keep reference to bmesh, or it will be garbage-collected
         self.bmesh = None
+        # Within a "with selection:" block, get_context() is resolved only once
+        self.__context_cache = None
+        self.__context_depth = 0
+    
+    def __enter__(self):
+        if self.__context_depth == 0: self.__context_cache = None
+        self.__context_depth += 1
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.__context_depth -= 1
+        if self.__context_depth == 0: self.__context_cache = None
+    
+    def __get_bmesh(self, mesh):
+        # Reuse the edit-mode bmesh as long as it stays valid
+        bm = self.bmesh
+        if not (bm and bm.is_valid):
+            bm = bmesh.from_edit_mesh(mesh)
+            self.bmesh = bm
+        return bm
     
     def get_context(self):
+        if self.__context_cache: return self.__context_cache
         context = self.context or bpy.context
         mode = self.mode or context.mode
         active_obj = context.active_object
@@ -46,7 +178,9 @@ class Selection:
         mode = BlEnums.normalize_mode(mode, active_obj)
         if not BlEnums.is_mode_valid(mode, active_obj):
             mode = None # invalid request
-        return context, active_obj, actual_mode, mode
+        result = (context, active_obj, actual_mode, mode)
+        if self.__context_depth: self.__context_cache = result
+        return result
     
     @property
     def normalized_mode(self):
@@ -54,26 +188,39 @@ class Selection:
     
     @property
     def stateless_info(self):
-        history, active, total = next(self.walk(), (None,None,0))
-        active_id = active.name if hasattr(active, "name") else hash(active)
+        history, active, total = self.__head() or (None,None,0)
+        active_id = getattr(active, "name", None)
+        if active_id is None: active_id = hash(active)
         return (total, active_id)
     
     @property
     def active(self):
-        return next(self.walk(), (None,None))[1]
+        head = self.__head()
+        return (head[1] if head else None)
     @active.setter
     def active(self, value):
         self.update_active(value)
     
     @property
     def history(self):
-        return next(self.walk(), (None,))[0]
+        head = self.__head()
+        return (head[0] if head else None)
     @history.setter
     def history(self, value):
         self.update_history(value)
     
     @property
     def selected(self):
+        context, active_obj, actual_mode, mode = self.get_context()
+        if mode == 'OBJECT':
+            # Blender already maintains the list of selected objects
+            select = select_sel_map(self.container)[True]
+            selected = {}
+            for obj in context.selected_objects:
+                if not (obj and obj.name): break # object deleted (state disrupted)
+                selected[obj] = select
+            return selected
+        
         walker = self.walk()
         next(walker, None) # skip active item
         return dict(item for item in walker if item[1])
@@ -99,26 +246,20 @@ class Selection:
             if actual_mode == 'EDIT_MESH':
                 return bool(mesh.total_vert_sel)
             else:
-                return any(item.select for item in mesh.vertices)
+                return foreach_any(mesh.vertices, "select")
         elif mode in {'EDIT_CURVE', 'EDIT_SURFACE'}:
             for spline in active_obj.data.splines:
-                for item in spline.bezier_points:
-                    if (item.select_control_point or
-                        item.select_left_handle or
-                        item.select_right_handle):
-                        return True
-                for item in spline.points:
-                    if item.select:
-                        return True
+                if foreach_any(spline.bezier_points, "select_control_point",
+                    "select_left_handle", "select_right_handle"): return True
+                if foreach_any(spline.points, "select"): return True
         elif mode == 'EDIT_METABALL':
             return bool(active_obj.data.elements.active)
         elif mode == 'EDIT_LATTICE':
-            return any(item.select for item in active_obj.data.points)
+            return foreach_any(active_obj.data.points, "select")
         elif mode == 'EDIT_ARMATURE':
-            return any(item.select_head or item.select_tail
-                       for item in active_obj.data.edit_bones)
+            return foreach_any(active_obj.data.edit_bones, "select_head", "select_tail")
         elif mode == 'POSE':
-            return any(item.select for item in active_obj.data.bones)
+            return foreach_any(active_obj.data.bones, "select")
         elif mode == 'PARTICLE':
             # Theoretically, particle keys can be selected,
             # but there seems to be no API for working with this
@@ -128,171 +269,171 @@ class Selection:
         
         return False
     
-    def walk(self):
-        """Iterates over selection, returning (history, active, count) first, then (element, selected_attributes) until exhausted"""
-        context, active_obj, actual_mode, mode = self.get_context()
-        if not mode: return
+    def __mesh_colls(self, faces, edges, verts):
+        elem_types = self.elem_types
         
-        container = self.container
-        sel_map = {False: container(), True: container(("select",))}
+        # No, by default all selected elements should be returned!
+        #if not elem_types:
+        #    elem_types = bm.select_mode
+        
+        colls = []
+        if (not elem_types) or ('FACE' in elem_types):
+            colls.append(faces)
+        if (not elem_types) or ('EDGE' in elem_types):
+            colls.append(edges)
+        if (not elem_types) or ('VERT' in elem_types):
+            colls.append(verts)
+        return colls
+    
+    def __mesh_count(self, faces, edges, verts):
+        elem_types = self.elem_types
+        if not elem_types: return len(faces) + len(edges) + len(verts)
+        count = 0
+        if 'FACE' in elem_types: count += len(faces)
+        if 'EDGE' in elem_types: count += len(edges)
+        if 'VERT' in elem_types: count += len(verts)
+        return count
+    
+    def __head(self, context_info=None):
+        """Returns (history, active, count) without iterating over the elements (None if not applicable)"""
+        context, active_obj, actual_mode, mode = context_info or self.get_context()
+        if not mode: return None
         
         if mode != 'EDIT_MESH': self.bmesh = None
         
         if mode == 'OBJECT':
-            total = len(context.selected_objects)
-            item = active_obj
-            yield ([], item, total)
-            
-            select = sel_map[True] # selected by definition
-            for item in context.selected_objects:
-                if not (item and item.name): return # object deleted (state disrupted)
-                yield (item, select)
+            return ([], active_obj, len(context.selected_objects))
         elif mode == 'EDIT_MESH':
             mesh = active_obj.data
-            elem_types = self.elem_types
             if actual_mode == 'EDIT_MESH':
-                if self.copy_bmesh:
-                    self.bmesh = bmesh.from_edit_mesh(mesh).copy()
-                else:
-                    if not (self.bmesh and self.bmesh.is_valid):
-                        self.bmesh = bmesh.from_edit_mesh(mesh)
-                bm = self.bmesh
-                
+                bm = self.__get_bmesh(mesh)
                 item = bm.faces.active
                 
                 if mesh.total_vert_sel == 0: # non-0 only in Edit mode
-                    yield ([], item, 0)
-                    return
-                
-                # No, by default all selected elements should be returned!
-                #if not elem_types:
-                #    elem_types = bm.select_mode
+                    return ([], item, 0)
                 
-                colls = []
-                if (not elem_types) or ('FACE' in elem_types):
-                    colls.append(bm.faces)
-                if (not elem_types) or ('EDGE' in elem_types):
-                    colls.append(bm.edges)
-                if (not elem_types) or ('VERT' in elem_types):
-                    colls.append(bm.verts)
-                
-                total = sum(len(items) for items in colls)
+                total = self.__mesh_count(bm.faces, bm.edges, bm.verts)
                 if bm.select_history:
-                    yield (list(bm.select_history), item, total)
+                    return (list(bm.select_history), item, total)
                 else:
-                    yield ([], item, total)
-                
-                for items in colls:
-                    for item in items:
-                        if not item.is_valid:
-                            self.bmesh = None
-                            return
-                        yield (item, sel_map[item.select])
+                    return ([], item, total)
             else:
                 self.bmesh = None
                 
-                colls = []
-                if (not elem_types) or ('FACE' in elem_types):
-                    colls.append(mesh.polygons)
-                if (not elem_types) or ('EDGE' in elem_types):
-                    colls.append(mesh.edges)
-                if (not elem_types) or ('VERT' in elem_types):
-                    colls.append(mesh.vertices)
-                
-                total = sum(len(items) for items in colls)
+                total = self.__mesh_count(mesh.polygons, mesh.edges, mesh.vertices)
                 item = None
                 if mesh.polygons.active >= 0:
                     item = mesh.polygons[mesh.polygons.active]
-                yield ([], item, total)
-                
-                for items in colls:
-                    for item in items:
-                        yield (item, sel_map[item.select])
+                return ([], item, total)
         elif mode in {'EDIT_CURVE', 'EDIT_SURFACE'}:
             total = sum(len(spline.bezier_points) + len(spline.points)
                 for spline in active_obj.data.splines)
-            yield ([], None, total)
-            
-            bezier_sel_map = {
-                (False, False, False): container(),
-                (True, False, False): container(("select_left_handle",)),
-                (False, True, False): container(("select_control_point",)),
-                (False, False, True): container(("select_right_handle",)),
-                (True, True, False): container(("select_left_handle", "select_control_point")),
-                (False, True, True): container(("select_control_point", "select_right_handle")),
-                (True, False, True): container(("select_left_handle", "select_right_handle")),
-                (True, True, True): container(("select_left_handle", "select_control_point", "select_right_handle")),
-            }
+            return ([], None, total)
+        elif mode == 'EDIT_METABALL':
+            total = 1 # only active is known in current API
+            return ([], active_obj.data.elements.active, total)
+        elif mode == 'EDIT_LATTICE':
+            return ([], None, len(active_obj.data.points))
+        elif mode == 'EDIT_ARMATURE':
+            edit_bones = active_obj.data.edit_bones
+            return ([], edit_bones.active, len(edit_bones))
+        elif mode == 'POSE':
+            bones = active_obj.data.bones
+            item = bones.active
+            if self.pose_bones:
+                item = (active_obj.pose.bones.get(item.name) if item else None)
+            return ([], item, len(bones))
+        else:
+            # PARTICLE: theoretically, particle keys can be selected,
+            # but there seems to be no API for working with this.
+            # No selectable elements in other modes.
+            return None
+    
+    def walk(self):
+        """Iterates over selection, returning (history, active, count) first, then (element, selected_attributes) until exhausted"""
+        context_info = self.get_context()
+        context, active_obj, actual_mode, mode = context_info
+        if not mode: return
+        
+        if (mode == 'EDIT_MESH') and (actual_mode == 'EDIT_MESH') and self.copy_bmesh:
+            self.bmesh = bmesh.from_edit_mesh(active_obj.data).copy()
+        
+        head = self.__head(context_info)
+        if head is None: return
+        bm = self.bmesh
+        yield head
+        
+        container = self.container
+        sel_map = select_sel_map(container)
+        
+        if mode == 'OBJECT':
+            select = sel_map[True] # selected by definition
+            for item in context.selected_objects:
+                if not (item and item.name): return # object deleted (state disrupted)
+                yield (item, select)
+        elif mode == 'EDIT_MESH':
+            mesh = active_obj.data
+            if actual_mode == 'EDIT_MESH':
+                if head[2] == 0: return
+                
+                # Accessing a dead bmesh element raises ReferenceError,
+                # so there's no need to check is_valid for each element
+                try:
+                    for items in self.__mesh_colls(bm.faces, bm.edges, bm.verts):
+                        for item in items:
+                            yield (item, sel_map[item.select])
+                except ReferenceError:
+                    self.bmesh = None
+            else:
+                for items in self.__mesh_colls(mesh.polygons, mesh.edges, mesh.vertices):
+                    for item, select in zip(items, foreach_get_bools(items, "select")):
+                        yield (item, sel_map[select])
+        elif mode in {'EDIT_CURVE', 'EDIT_SURFACE'}:
+            bezier_names = ("select_left_handle", "select_control_point", "select_right_handle")
+            bezier_sel_table = flags_sel_table(container, bezier_names)
             
             # It seems like the only way the validity of spline can be determined
             # is to check if path_from_id() returns empty string.
             # However, it also seems that Blender does not crash when trying to
             # access deleted splines or their points.
             for spline in active_obj.data.splines:
-                for item in spline.bezier_points:
-                    yield (item, bezier_sel_map[(item.select_left_handle, item.select_control_point, item.select_right_handle)])
+                items = spline.bezier_points
+                for item, code in zip(items, foreach_get_flags(items, bezier_names)):
+                    yield (item, bezier_sel_table[code])
                 
-                for item in spline.points:
-                    yield (item, sel_map[item.select])
+                items = spline.points
+                for item, select in zip(items, foreach_get_bools(items, "select")):
+                    yield (item, sel_map[select])
         elif mode == 'EDIT_METABALL':
-            total = 1 # only active is known in current API
-            item = active_obj.data.elements.active
-            yield ([], item, total)
-            
             # We don't even know if active element is actually selected
             # Just assume it is, to have at least some information
-            #yield (item, container())
-            yield (item, sel_map[True])
+            #yield (head[1], container())
+            yield (head[1], sel_map[True])
         elif mode == 'EDIT_LATTICE':
-            total = len(active_obj.data.points)
-            yield ([], None, total)
-            
-            for item in active_obj.data.points:
-                yield (item, sel_map[item.select])
+            points = active_obj.data.points
+            for item, select in zip(points, foreach_get_bools(points, "select")):
+                yield (item, sel_map[select])
         elif mode == 'EDIT_ARMATURE':
-            total = len(active_obj.data.edit_bones)
-            item = active_obj.data.edit_bones.active
-            yield ([], item, total)
+            editbone_names = ("select_head", "select", "select_tail")
+            editbone_sel_table = flags_sel_table(container, editbone_names)
             
-            editbone_sel_map = {
-                (False, False, False): container(),
-                (True, False, False): container(("select_head",)),
-                (False, True, False): container(("select",)),
-                (False, False, True): container(("select_tail",)),
-                (True, True, False): container(("select_head", "select")),
-                (False, True, True): container(("select", "select_tail")),
-                (True, False, True): container(("select_head", "select_tail")),
-                (True, True, True): container(("select_head", "select", "select_tail")),
-            }
-            
-            for item in active_obj.data.edit_bones:
+            items = active_obj.data.edit_bones
+            for item, code in zip(items, foreach_get_flags(items, editbone_names)):
                 if not (item and item.name): return # object deleted (state disrupted)
-                yield (item, editbone_sel_map[(item.select_head, item.select, item.select_tail)])
+                yield (item, editbone_sel_table[code])
         elif mode == 'POSE':
-            total = len(active_obj.data.bones)
-            item = active_obj.data.bones.active
-            
+            bones = active_obj.data.bones
             if self.pose_bones:
                 pose_bones = active_obj.pose.bones
-                
-                pb = (pose_bones.get(item.name) if item else None)
-                yield ([], pb, total)
-                
-                for item in active_obj.data.bones:
-                    if not (item and item.name): return # object deleted (state disrupted)
-                    yield (pose_bones.get(item.name), sel_map[item.select])
+                pose_bones_get = pose_bones.get
+                for item, select in zip(bones, foreach_get_bools(bones, "select")):
+                    name = (item.name if item else None)
+                    if not name: return # object deleted (state disrupted)
+                    yield (pose_bones_get(name), sel_map[select])
             else:
-                yield ([], item, total)
-                
-                for item in active_obj.data.bones:
+                for item, select in zip(bones, foreach_get_bools(bones, "select")):
                     if not (item and item.name): return # object deleted (state disrupted)
-                    yield (item, sel_map[item.select])
-        elif mode == 'PARTICLE':
-            # Theoretically, particle keys can be selected,
-            # but there seems to be no API for working with this
-            pass
-        else:
-            pass # no selectable elements in other modes
+                    yield (item, sel_map[select])
     
     def update_active(self, item):
         context, active_obj, actual_mode, mode = self.get_context()
@@ -303,8 +444,7 @@ class Selection:
         elif mode == 'EDIT_MESH':
             mesh = active_obj.data
             if actual_mode == 'EDIT_MESH':
-                bm = self.bmesh or bmesh.from_edit_mesh(mesh)
-                self.bmesh = bm
+                bm = self.__get_bmesh(mesh)
                 bm.faces.active = item
             else:
                 mesh.polygons.active = (item.index if item else -1)
@@ -333,8 +473,7 @@ class Selection:
         if mode == 'EDIT_MESH':
             mesh = active_obj.data
             if actual_mode == 'EDIT_MESH':
-                bm = self.bmesh or bmesh.from_edit_mesh(mesh)
-                self.bmesh = bm
+                bm = self.__get_bmesh(mesh)
                 
                 bm.select_history.clear()
                 for item in history:
@@ -427,7 +566,7 @@ class Selection:
         
         return select_all_action, data
     
-    def __update_make_selector_expression(self, name, use_kv, expr_info):
+    def __update_make_selector_expression(self, name, use_kv, expr_info, single=False):
         operation, new_toggled, invert_new, old_toggled, invert_old = expr_info
         
         data_code = ("value" if use_kv else "data.get(item, '')")
@@ -439,6 +578,9 @@ class Selection:
         
         if new_toggled is not None:
             code_new = repr(new_toggled)
+        elif single:
+            # The only possible attribute: a non-empty value means selected
+            code_new = ("(not value)" if invert_new else "bool(value)")
         elif invert_new:
             code_new = f"({repr(name)} not in {data_code})"
         else:
@@ -499,12 +641,14 @@ class Selection:
             if len(type_names) < 2:
                 item_type, names = type_names[0]
                 
+                single = use_kv and (len(names) == 1)
+                
                 if (not use_kv) and (len(names) > 1):
                     lines.append(expr_tab + "value = data.get(item, '')")
                     use_kv = True
                 
                 for name in names:
-                    lines.append(expr_tab + expr_maker(name, use_kv, expr_info))
+                    lines.append(expr_tab + expr_maker(name, use_kv, expr_info, single))
             else:
                 tab_if = expr_tab
                 expr_tab += tab
@@ -533,17 +677,14 @@ class Selection:
     __cached_selectors = {}
     
     def update(self, data, operation='SET'):
+        with self:
+            self.__update(data, operation)
+    
+    def __update(self, data, operation):
         if not isinstance(data, dict):
             raise ValueError("data must be a dict")
         
-        toggle_old = operation.startswith("^")
-        invert_old = operation.startswith("!")
-        toggle_new = operation.endswith("^")
-        invert_new = operation.endswith("!")
-        operation = operation.replace("!", "").replace("^", "")
-        
-        if operation not in {'SET', 'OR', 'AND', 'XOR'}:
-            raise ValueError("operation must be one of {'SET', 'OR', 'AND', 'XOR'}")
+        operation, toggle_old, invert_old, toggle_new, invert_new = parse_update_operation(operation)
         
         context, active_obj, actual_mode, mode = self.get_context()
         if not mode: return
@@ -571,6 +712,30 @@ class Selection:
             #print(selector)
             return selector
         
+        def foreach_select(items, names, indexed_type=None):
+            # Brute-force update via foreach_get/foreach_set (for RNA collections)
+            masks = dict.fromkeys(names)
+            if expr_info[1] is not None: # new_toggled
+                pass
+            elif indexed_type:
+                # Elements know their index, so only the (sparse) data
+                # needs to be iterated to build the masks
+                count = len(items)
+                for name in names:
+                    masks[name] = np.zeros(count, dtype=bool)
+                for item, value in data.items():
+                    if not (value and isinstance(item, indexed_type)): continue
+                    i = item.index
+                    if (i >= count) or (items[i] != item): continue # not from this collection
+                    for name in names:
+                        if name in value: masks[name][i] = True
+            else:
+                values = [data.get(item, "") for item in items]
+                for name in names:
+                    masks[name] = np.fromiter(((name in value) for value in values), dtype=bool, count=len(values))
+            for name in names:
+                foreach_update_bools(items, name, masks[name], expr_info)
+        
         if mode == 'OBJECT':
             if select_all_action:
                 bpy.ops.object.select_all(action=select_all_action)
@@ -578,7 +743,7 @@ class Selection:
             if use_brute_force:
                 selector = make_selector({"names":[(None, [("select", "{0}.select_get()", "{0}.select_set({1})")])]})
                 selector(context.scene.objects, data=data)
-            else:
+            elif data: # with no data, select_all() has already done everything
                 selector = make_selector({"names":[(None, [("select", "{0}.select_get()", "{0}.select_set({1})")])], "use_kv":True})
                 selector(data)
         elif mode == 'EDIT_MESH':
@@ -587,18 +752,22 @@ class Selection:
             
             mesh = active_obj.data
             if is_actual_mode:
-                bm = self.bmesh or bmesh.from_edit_mesh(mesh)
-                self.bmesh = bm
+                bm = self.__get_bmesh(mesh)
                 faces, edges, verts = bm.faces, bm.edges, bm.verts
             else:
                 faces, edges, verts = mesh.polygons, mesh.edges, mesh.vertices
             
-            if use_brute_force:
+            if use_brute_force and not is_actual_mode:
+                # Mesh (unlike bmesh) collections support foreach_get/set
+                foreach_select(faces, ["select"], bpy.types.MeshPolygon)
+                foreach_select(edges, ["select"], bpy.types.MeshEdge)
+                foreach_select(verts, ["select"], bpy.types.MeshVertex)
+            elif use_brute_force:
                 selector = make_selector({"names":[(None, ["select"])]})
                 selector(faces, data=data)
                 selector(edges, data=data)
                 selector(verts, data=data)
-            else:
+            elif data:
                 selector = make_selector({"names":[(None, ["select"])], "use_kv":True})
                 selector(data)
             
@@ -613,10 +782,10 @@ class Selection:
             
             bezier_names = (bpy.types.BezierSplinePoint, ["select_control_point", "select_left_handle", "select_right_handle"])
             if use_brute_force:
-                selector = make_selector({"names":[bezier_names]}, {"names":[(None, ["select"])]})
                 for spline in active_obj.data.splines:
-                    selector(spline.bezier_points, spline.points, data=data)
-            else:
+                    foreach_select(spline.bezier_points, bezier_names[1])
+                    foreach_select(spline.points, ["select"])
+            elif data:
                 selector = make_selector({"names":[bezier_names, (None, ["select"])], "use_kv":True})
                 selector(data)
         elif mode == 'EDIT_METABALL':
@@ -630,7 +799,7 @@ class Selection:
             if use_brute_force:
                 selector = make_selector({"names":[(None, ["select"])]})
                 selector(active_obj.data.points, data=data)
-            else:
+            elif data:
                 selector = make_selector({"names":[(None, ["select"])], "use_kv":True})
                 selector(data)
         elif mode == 'EDIT_ARMATURE':
@@ -638,9 +807,8 @@ class Selection:
                 bpy.ops.armature.select_all(action=select_all_action)
             
             if use_brute_force:
-                selector = make_selector({"names":[(None, ["select_head", "select", "select_tail"])]})
-                selector(active_obj.data.edit_bones, data=data)
-            else:
+                foreach_select(active_obj.data.edit_bones, ["select_head", "select", "select_tail"])
+            elif data:
                 selector = make_selector({"names":[(None, ["select_head", "select", "select_tail"])], "use_kv":True})
                 selector(data)
         elif mode == 'POSE':
@@ -648,9 +816,8 @@ class Selection:
                 bpy.ops.pose.select_all(action=select_all_action)
             
             if use_brute_force:
-                selector = make_selector({"names":[(None, ["select"])], "item_map":"context.data.bones"})
-                selector(active_obj.data.bones, data=data, context=active_obj)
-            else:
+                foreach_select(active_obj.data.bones, ["select"])
+            elif data:
                 selector = make_selector({"names":[(None, ["select"])], "item_map":"context.data.bones", "use_kv":True})
                 selector(data, context=active_obj)
         elif mode == 'PARTICLE':
@@ -666,28 +833,32 @@ class SelectionSnapshot:
     # so brute_force_update=True (since select_all operators are recorded in the info log)
     def __init__(self, context=None, brute_force_update=True):
         sel = Selection(context, brute_force_update=brute_force_update)
-        self.snapshot_curr = (sel, sel.active, sel.history, sel.selected)
+        with sel:
+            self.snapshot_curr = (sel, sel.active, sel.history, sel.selected)
+            self.mode = sel.normalized_mode
         
-        self.mode = sel.normalized_mode
         if self.mode == 'OBJECT':
             self.snapshot_obj = self.snapshot_curr
         else:
             sel = Selection(context, 'OBJECT', brute_force_update=brute_force_update)
-            self.snapshot_obj = (sel, sel.active, sel.history, sel.selected)
+            with sel:
+                self.snapshot_obj = (sel, sel.active, sel.history, sel.selected)
     
     # Attention: it is assumed that there was no Undo,
     # objects' modes didn't change, and all elements are still valid
     def restore(self):
         if self.mode != 'OBJECT':
             sel, active, history, selected = self.snapshot_obj
+            with sel:
+                sel.selected = selected
+                sel.history = history
+                sel.active = active
+        
+        sel, active, history, selected = self.snapshot_curr
+        with sel:
             sel.selected = selected
             sel.history = history
             sel.active = active
-        
-        sel, active, history, selected = self.snapshot_curr
-        sel.selected = selected
-        sel.history = history
-        sel.active = active
     
     def __str__(self):
         if self.mode != 'OBJECT':
@@ -719,25 +890,29 @@ def IndividuallyActiveSelected(objects, context=None, make_visble=False):
         except Exception as exc:
             continue # object doesn't exist or not in view_layer
         
+        # Visibility writes trigger updates, so only hidden objects are touched
         if make_visble:
             prev_hide = obj.hide_get(view_layer=view_layer)
             prev_hide_viewport = obj.hide_viewport
-            obj.hide = False
-            obj.hide_viewport = False
+            if prev_hide: obj.hide_set(False, view_layer=view_layer)
+            if prev_hide_viewport: obj.hide_viewport = False
         
         yield obj
         
         if make_visble:
-            obj.hide_set(prev_hide, view_layer=view_layer)
-            obj.hide_viewport = prev_hide_viewport
+            if prev_hide: obj.hide_set(True, view_layer=view_layer)
+            if prev_hide_viewport: obj.hide_viewport = True
         
         obj.select_set(False, view_layer=view_layer)
     
     prev_selection.restore()
 
 class ResumableSelection:
-    def __init__(self, *args, **kwargs):
-        kwargs["copy_bmesh"] = True # seems like this is REQUIRED to avoid crashes
+    def __init__(self, *args, safe_copy=True, **kwargs):
+        # Copying seems to be REQUIRED to avoid crashes. Without the copy,
+        # the edit-mode bmesh is walked directly, and its invalidation
+        # (bm.is_valid / ReferenceError during the walk) triggers a reset.
+        kwargs["copy_bmesh"] = safe_copy
         self.selection = Selection(*args, **kwargs)
         self.selection_walker = None
         self.selection_initialized = False
@@ -747,16 +922,11 @@ class ResumableSelection:
         # Screen change doesn't actually invalidate the selection,
         # but it's a big enough change to justify the extra wait.
         # I added it to make batch-transform a bit more efficient.
-        self.mode = None
-        self.obj_hash = None
-        self.screen_hash = None
-        self.scene_hash = None
-        self.undo_hash = None
-        self.operators_len = None
-        self.objects_len = None
+        # (mode, obj_hash, screen_hash, scene_hash, undo_hash, operators_len)
+        self.state_key = None
         self.objects_selected_len = None
     
-    def __call__(self, duration=0):
+    def __call__(self, duration=0, batch_size=0):
         if duration is None: duration = float("inf")
         context = bpy.context
         wm = context.window_manager
@@ -769,8 +939,7 @@ class ResumableSelection:
         scene_hash = scene.as_pointer()
         undo_hash = bpy.data.as_pointer()
         operators_len = len(wm.operators)
-        objects_len = len(scene.objects)
-        objects_selected_len = len(context.selected_objects)
+        state_key = (mode, obj_hash, screen_hash, scene_hash, undo_hash, operators_len)
         
         object_updated = False
         if active_obj and ('EDIT' in active_obj.mode):
@@ -784,23 +953,18 @@ class ResumableSelection:
                 bm = self.selection.bmesh
                 object_updated |= (bm is None) or (not bm.is_valid)
         
-        reset = object_updated
-        reset |= (self.mode != mode)
-        reset |= (self.obj_hash != obj_hash)
-        reset |= (self.screen_hash != screen_hash)
-        reset |= (self.scene_hash != scene_hash)
-        reset |= (self.undo_hash != undo_hash)
-        reset |= (self.operators_len != operators_len)
-        #reset |= (self.objects_len != objects_len)
-        reset |= (self.objects_selected_len != objects_selected_len)
+        reset = object_updated or (self.state_key != state_key)
+        
+        # len() of an RNA collection is counted on the C side, whereas
+        # context.selected_objects would build a list of all selected objects
+        objects_selected_len = len(context.view_layer.objects.selected)
+        if mode != 'EDIT_MESH':
+            # In mesh editmode, the walked elements don't depend on object
+            # selection (and bmesh invalidation is checked separately)
+            reset = reset or (self.objects_selected_len != objects_selected_len)
+        
         if reset:
-            self.mode = mode
-            self.obj_hash = obj_hash
-            self.screen_hash = screen_hash
-            self.scene_hash = scene_hash
-            self.undo_hash = undo_hash
-            self.operators_len = operators_len
-            self.objects_len = objects_len
+            self.state_key = state_key
             self.objects_selected_len = objects_selected_len
             
             self.selection.bmesh = None
@@ -828,16 +992,35 @@ class ResumableSelection:
                 yield (0, active) # ACTIVE
                 if clock() > time_stop: return
         
+        # Walking an element is cheaper than a perf_counter() call,
+        # so time is checked only once per 256 elements
+        # With batch_size > 0, selected elements are reported in lists
+        # (fewer generator resumptions on large selections)
+        batch = ([] if batch_size > 0 else None)
         for item in self.selection_walker:
             self.selection_count += 1
-            if item[1]: yield (1, item[0]) # SELECTED
-            if clock() > time_stop: break
+            if item[1]:
+                if batch is None:
+                    yield (1, item[0]) # SELECTED
+                else:
+                    batch.append(item[0])
+                    if len(batch) >= batch_size:
+                        yield (2, batch) # SELECTED_BATCH
+                        batch = []
+            if ((self.selection_count & 255) == 0) and (clock() > time_stop):
+                if batch: yield (2, batch) # SELECTED_BATCH
+                break
         else: # the iterator is exhausted
+            if batch: yield (2, batch) # SELECTED_BATCH
+            # The walk clears the bmesh if it became invalid midway
+            # (possible without safe_copy), so the walk was truncated
+            truncated = (mode == 'EDIT_MESH') and (self.selection.bmesh is None)
             self.selection.bmesh = None
             self.selection_walker = None
-            yield (-1, None) # FINISHED
+            yield ((-2 if truncated else -1), None) # RESET / FINISHED
     
     RESET = -2
     FINISHED = -1
     ACTIVE = 0
     SELECTED = 1
+    SELECTED_BATCH = 2
@@ -15,11 +15,26 @@
 #
 #  ***** END GPL LICENSE BLOCK *****
 
+import math
 import re
+from functools import lru_cache
+
+import numpy as np
 
 #============================================================================#
 
+# For letter-only ASCII strings, the case transition rules below
+# are equivalent to a simple tokenization of camelcase words
+_camelcase_words = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+")
+
 def split_camelcase(s):
+    if s.isalpha() and s.isascii():
+        # The first character is never examined, so it acts as an uppercase one
+        parts = _camelcase_words.findall("A" + s[1:])
+        parts[0] = s[0] + parts[0][1:]
+        yield from parts
+        return
+    
     i0 = 0
     was_upper = True
     for i in range(1, len(s)):
@@ -45,53 +60,69 @@ def compress_whitespace(s, keep='INDENTATION'):
 
 def indent(s, t):
     if not t: return s
-    res = []
-    for l in s.splitlines():
-        res.append(t + l)
-    return "\n".join(res)
+    lines = s.splitlines()
+    if not lines: return ""
+    return t + ("\n" + t).join(lines)
 
 def unindent(s, t=None):
     if (not s) or (not s[0].isspace()): return s
     
     lines = s.splitlines()
+    stripped = [l.lstrip() for l in lines] # reused for the output
     if t is None:
-        nt = len(s)
-        for l in lines:
-            nd = len(l) - len(l.lstrip())
-            if nd == 0: continue # ignore whitespace-only lines
-            nt = min(nt, nd)
-            if nt == 0: break
+        # ignore whitespace-only lines
+        nt = min([len(l) - len(ls) for l, ls in zip(lines, stripped) if len(ls) != len(l)] or [len(s)])
     else:
         nt = len(t)
     
     if nt == 0: return s
     
-    res = []
-    for l in lines:
-        nd = len(l) - len(l.lstrip())
-        res.append(l[min(nt, nd):])
-    return "\n".join(res)
+    return "\n".join([(ls if len(l) - len(ls) <= nt else l[nt:]) for l, ls in zip(lines, stripped)])
+
+_brackets_open = frozenset("[{(")
+_brackets_close = frozenset("]})")
+
+def _split_expressions_np(s, sep, strip):
+    codes = _str_codes(s)
+    opens = (codes == 40) | (codes == 91) | (codes == 123) # ( [ {
+    closes = (codes == 41) | (codes == 93) | (codes == 125) # ) ] }
+    depth = np.cumsum(opens, dtype=np.int64)
+    depth -= np.cumsum(closes, dtype=np.int64)
+    # Tabs are separators too (same as in the character-replacing version)
+    split_mask = (codes == ord(sep)) & (depth == 0)
+    split_mask |= (codes == 9)
+    ends = np.flatnonzero(split_mask).tolist()
+    starts = [0] + [i+1 for i in ends]
+    ends.append(len(s))
+    res = [s[i0:i1] for i0, i1 in zip(starts, ends)]
+    return ([s.strip() for s in res] if strip else res)
 
 def split_expressions(s, sep="\t", strip=False):
     if sep == "\t":
         text = s
     else:
         sep = sep.strip()
-        text = ""
+        if (len(s) >= 1024) and (len(sep) == 1):
+            return _split_expressions_np(s, sep, strip)
+        chars = list(s)
         brackets = 0
-        for c in s:
-            if c in "[{(":
+        for i, c in enumerate(chars):
+            if c in _brackets_open:
                 brackets += 1
-            elif c in "]})":
+            elif c in _brackets_close:
                 brackets -= 1
             if (brackets == 0) and (c == sep):
-                c = "\t"
-            text += c
+                chars[i] = "\t"
+        text = "".join(chars)
     
     res = text.split("\t")
     return ([s.strip() for s in res] if strip else res)
 
 def math_eval(s):
+    try:
+        return float(s) # plain numbers don't need eval()
+    except (TypeError, ValueError):
+        pass
     try:
         return float(eval(s, math.__dict__))
     except Exception:
@@ -138,31 +169,75 @@ def vector_from_text(v, s, sep="\t", axes_names="xyzw"):
         if v_i is not None:
             v[i] = v_i
 
+def _str_codes(s):
+    return np.frombuffer(s.encode("utf-32-le", "surrogatepass"), dtype="<u4")
+
+def _longest_common_substring_np(S, T):
+    # Row-by-row sweep of the same dynamic programming table, but each
+    # row is computed in one vectorized step (and only one row is kept)
+    if len(S) > len(T): S, T = T, S # loop over the shorter string, vectorize along the longer one
+    a, b = _str_codes(S), _str_codes(T)
+    n = len(b)
+    counter = np.zeros(n+1, dtype=np.int64)
+    longest = 0
+    ends = []
+    for j in range(len(a)):
+        row = np.zeros(n+1, dtype=np.int64)
+        np.add(counter[:-1], 1, out=row[1:], where=(b == a[j]))
+        c = int(row.max())
+        if c > longest:
+            longest = c
+            ends = [j]
+        elif (c == longest) and (c > 0):
+            ends.append(j)
+        counter = row
+    return {S[j-longest+1:j+1] for j in ends}
+
 # From http://www.bogotobogo.com/python/python_longest_common_substring_lcs_algorithm_generalized_suffix_tree.php
 # Actually applicable to any sequence with hashable elements
 def longest_common_substring(S, T):
-    m = len(S)
+    # numpy pays off only when the vectorized (longer) side is long enough
+    if isinstance(S, str) and isinstance(T, str) and (len(S) * len(T) >= 4096) and (max(len(S), len(T)) >= 128):
+        return _longest_common_substring_np(S, T)
+    
     n = len(T)
-    counter = [[0]*(n+1) for x in range(m+1)]
+    counter = [0]*(n+1) # only the previous row is needed
     longest = 0
-    lcs_set = set()
-    for i in range(m):
+    ends = set() # substrings are sliced only at the end
+    for i in range(len(S)):
+        row = [0]*(n+1)
+        S_i = S[i]
         for j in range(n):
-            if S[i] == T[j]:
-                c = counter[i][j] + 1
-                counter[i+1][j+1] = c
+            if S_i == T[j]:
+                c = counter[j] + 1
+                row[j+1] = c
                 if c > longest:
                     longest = c
-                    lcs_set = {S[i-c+1:i+1]}
+                    ends = {i}
                 elif c == longest:
-                    lcs_set.add(S[i-c+1:i+1])
-    return lcs_set
+                    ends.add(i)
+        counter = row
+    return {S[i-longest+1:i+1] for i in ends}
 
 # Adapted from https://gist.github.com/regularcoder/8254723
 def fletcher(data, n): # n should be 16, 32 or 64
     nbytes = min(max(n // 16, 1), 4)
     mod = 2 ** (8 * nbytes) - 1
     sum1 = sum2 = 0
+    if len(data) >= 256:
+        # The last incomplete block is equivalent to a zero-padded one
+        pad = (-len(data)) % nbytes
+        if pad: data = bytes(data) + bytes(pad)
+        blocks = np.frombuffer(data, dtype=f"<u{nbytes}").astype(np.uint64)
+        # Chunks are small enough for the running sums not to overflow
+        chunk_size = 65536
+        for i in range(0, len(blocks), chunk_size):
+            sums = np.cumsum(blocks[i:i + chunk_size])
+            sums += sum1
+            sums %= mod
+            sum1 = int(sums[-1])
+            sum2 = (sum2 + int(sums.sum())) % mod
+        return sum1 + (sum2 * (mod+1))
     for i in range(0, len(data), nbytes):
         block = int.from_bytes(data[i:i + nbytes], 'little')
         sum1 = (sum1 + block) % mod
@@ -170,18 +245,21 @@ def fletcher(data, n): # n should be 16, 32 or 64
     return sum1 + (sum2 * (mod+1))
 
 def hashnames():
-    hashnames_codes = [chr(o) for o in range(ord("0"), ord("9")+1)]
-    hashnames_codes += [chr(o) for o in range(ord("A"), ord("Z")+1)]
+    hashnames_codes = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     n = len(hashnames_codes)
-    def _hashnames(names):
-        binary_data = "\0".join(sorted(names)).encode()
+    @lru_cache(maxsize=256)
+    def _hashnames_sorted(names):
+        binary_data = b"\0".join(name.encode() for name in names)
         hash_value = fletcher(binary_data, 32)
-        result = []
+        result = bytearray()
         while True:
-            k = hash_value % n
+            hash_value, k = divmod(hash_value, n)
             result.append(hashnames_codes[k])
-            hash_value = (hash_value - k) // n
             if hash_value == 0: break
-        return "".join(result)
+        return result.decode("ascii")
+    def _hashnames(names):
+        # Duplicate names affect the hash, so the cache key
+        # has to be a sorted tuple rather than a frozenset
+        return _hashnames_sorted(tuple(sorted(names)))
     return _hashnames
 hashnames = hashnames()
@@ -16,6 +16,8 @@
 #  ***** END GPL LICENSE BLOCK *****
 
 from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
 
 import bpy
 
@@ -25,166 +27,251 @@ from .utils_python import reverse_enumerate
 from .bpy_inspect import BlRna
 
 class InputKeyMonitor:
+    __slots__ = ("event", "key_bits", "prev_states", "states", "invoke_key", "invoke_event",
+        "update_counter", "modifier_bits", "modifiers_mask")
+    
     def __init__(self, event=None):
         self.event = ""
-        self.prev_states = {}
-        self.states = {}
+        # Key states are stored as bits of an int (each key name gets
+        # its own bit on first use), so that saving the previous states
+        # is a plain assignment and keycheckers can test all their keys
+        # with a few bitwise operations
+        self.key_bits = {}
+        self.prev_states = 0
+        self.states = 0
         self.invoke_key = 'NONE'
         self.invoke_event = 'NONE'
         self.update_counter = 0
         
+        self.modifier_bits = tuple(self.key_bit(name) for name in ('alt', 'ctrl', 'oskey', 'shift'))
+        self.modifiers_mask = sum(self.modifier_bits)
+        
         if event is not None:
             self.invoke_key = event.type
             self.invoke_event = event.value
             self.update(event)
     
+    def key_bit(self, name):
+        bit = self.key_bits.get(name)
+        if bit is None:
+            bit = 1 << len(self.key_bits)
+            self.key_bits[name] = bit
+        return bit
+    
     def __getitem__(self, name):
-        if name.endswith(":ON"):
-            return self.states.setdefault(name, False)
-        elif name.endswith(":OFF"):
-            return not self.states.setdefault(name, False)
-        elif ":" not in name:
-            return self.states.setdefault(name, False)
+        # Reading a key that was never set doesn't need to allocate a bit for it
+        head, sep, tail = name.rpartition(":") # one scan for the suffix
+        if (not sep) or (tail == "ON"):
+            return bool(self.states & self.key_bits.get(name, 0))
+        elif tail == "OFF":
+            return not (self.states & self.key_bits.get(name, 0))
         else:
             return self.event == name
     
     def __setitem__(self, name, state):
-        self.states[name] = state
+        if state:
+            self.states |= self.key_bit(name)
+        else:
+            self.states &= ~self.key_bit(name)
     
     def update(self, event):
         self.update_counter += 1
         
-        self.prev_states.update(self.states)
+        states = self.states
+        self.prev_states = states
         
         if (event.value == 'PRESS') or (event.value == 'DOUBLE_CLICK'):
-            self.states[event.type] = True
+            states |= self.key_bit(event.type)
         elif event.value == 'RELEASE':
-            self.states[event.type] = False
+            states &= ~self.key_bit(event.type)
         
-        self.states['alt'] = event.alt
-        self.states['ctrl'] = event.ctrl
-        self.states['oskey'] = event.oskey
-        self.states['shift'] = event.shift
+        alt_bit, ctrl_bit, oskey_bit, shift_bit = self.modifier_bits
+        states &= ~self.modifiers_mask
+        if event.alt: states |= alt_bit
+        if event.ctrl: states |= ctrl_bit
+        if event.oskey: states |= oskey_bit
+        if event.shift: states |= shift_bit
+        self.states = states
         
         self.event = event.type+":"+event.value
     
     def keychecker(self, shortcut, default_state=False):
-        key_infos = self.get_keys(shortcut, self.invoke_key)
-        state_infos = [info for info in key_infos if info.event in self._state_events]
-        event_infos = [info for info in key_infos if info.event not in self._state_events]
-        
-        events_set = {info.full for info in event_infos}
+        try:
+            # Works for strings and for hashable parsed shortcuts
+            state_infos, event_infos, events_set = self._split_keys_str(shortcut, self.invoke_key)
+        except TypeError: # unhashable (e.g. a list of (key, set) pairs)
+            state_infos, event_infos, events_set = self._split_keys(self.get_keys(shortcut, self.invoke_key))
         event_state = {"state": default_state, "counter": self.update_counter}
         
-        def get_event_toggle(info):
-            return self.event == info.full
+        # Masks of the keys that are "on" when pressed / when released
+        mask_pos = 0
+        mask_neg = 0
+        for info in state_infos:
+            if info.invert:
+                mask_neg |= self.key_bit(info.key)
+            else:
+                mask_pos |= self.key_bit(info.key)
+        has_events = bool(event_infos)
         
-        def get_state_toggle(info, mask_pos, mask_neg):
-            state0 = int(self.prev_states.get(info.key, False))
-            state1 = int(self.states.get(info.key, False))
-            delta = state1 - state0
-            if info.invert: delta = -delta
-            return ((delta & mask_pos) > 0) or ((delta & mask_neg) < 0)
+        # Each mode gets its own closure, so check() does a single dict
+        # lookup instead of walking the chain of mode comparisons
+        def check_on_toggle(event, states):
+            if (states & mask_pos) or (~states & mask_neg): return 'ON'
+            if event in events_set: return 'TOGGLE'
+            return None
         
-        def get_event_on(info):
-            return event_state["state"]
+        def check_press(event, states):
+            prev_states = self.prev_states
+            if ((states & ~prev_states) & mask_pos) or ((prev_states & ~states) & mask_neg): return True
+            return (event in events_set)
+        
+        def check_release(event, states):
+            prev_states = self.prev_states
+            if ((prev_states & ~states) & mask_pos) or ((states & ~prev_states) & mask_neg): return True
+            return (event in events_set)
+        
+        def check_toggle(event, states):
+            if (states ^ self.prev_states) & (mask_pos | mask_neg): return True
+            return (event in events_set)
+        
+        def check_on(event, states):
+            if (states & mask_pos) or (~states & mask_neg): return True
+            return has_events and (event_state["state"] != False)
+        
+        def check_off(event, states):
+            if (~states & mask_pos) or (states & mask_neg): return True
+            return has_events and (event_state["state"] != True)
+        
+        def check_none(event, states):
+            return None
         
-        def get_state_on(info):
-            return self.states.get(info.key, False) != info.invert
+        checks = {'ON|TOGGLE':check_on_toggle, 'PRESS':check_press, 'RELEASE':check_release,
+            'TOGGLE':check_toggle, 'ON':check_on, 'OFF':check_off}
+        
+        if not events_set:
+            # State-only shortcut: the event toggle state is never used
+            def check(mode):
+                return checks.get(mode, check_none)(self.event, self.states)
+            
+            return check
         
         def check(mode):
-            if (self.event in events_set) and (self.update_counter != event_state["counter"]):
+            event = self.event
+            if (event in events_set) and (self.update_counter != event_state["counter"]):
                 event_state["state"] = not event_state["state"]
                 event_state["counter"] = self.update_counter
             
-            if mode == 'ON|TOGGLE':
-                for info in state_infos:
-                    if get_state_on(info): return 'ON'
-                for info in event_infos:
-                    if get_event_toggle(info): return 'TOGGLE'
-                return None
-            elif mode in {'TOGGLE', 'PRESS', 'RELEASE'}:
-                mask_pos = (0 if mode == 'RELEASE' else -1)
-                mask_neg = (0 if mode == 'PRESS' else -1)
-                for info in state_infos:
-                    if get_state_toggle(info, mask_pos, mask_neg): return True
-                for info in event_infos:
-                    if get_event_toggle(info): return True
-                return False
-            elif mode in {'ON', 'OFF'}:
-                invert = (mode == 'OFF')
-                for info in state_infos:
-                    if get_state_on(info) != invert: return True
-                for info in event_infos:
-                    if get_event_on(info) != invert: return True
-                return False
+            return checks.get(mode, check_none)(event, self.states)
         
         return check
     
     class KeyInfo:
         __slots__ = ["full", "key", "event", "is_state", "invert"]
-        def __init__(self, full):
-            self.full = full
-            self.key, self.event = full.split(":")
+        def __init__(self, key, event):
+            self.full = f"{key}:{event}"
+            self.key = key
+            self.event = event
             self.is_state = (self.event == 'ON') or (self.event == 'OFF')
             self.invert = (self.event == 'OFF')
     
     _invoke_key = '<INVOKE_KEY>'
-    _modifier_keys = {'shift', 'ctrl', 'alt', 'oskey'}
-    _variant_modifiers = {'shift', 'ctrl', 'alt'}
-    _variant_prefixes = ["LEFT_", "RIGHT_", "NDOF_BUTTON_"]
-    _state_events = {'ON', 'OFF'}
-    _keymap_keys = {item.identifier for item in bpy.types.KeyMapItem.bl_rna.properties["type"].enum_items} - {'NONE'}
-    _keymap_events = {item.identifier for item in bpy.types.KeyMapItem.bl_rna.properties["value"].enum_items} - {'NOTHING'}
-    _all_keys = _keymap_keys | _modifier_keys
-    _all_events = _keymap_events | _state_events
+    # These tables are read-only (and get_keys() results are cached), so they are frozen
+    _modifier_keys = frozenset({'shift', 'ctrl', 'alt', 'oskey'})
+    _variant_modifiers = frozenset({'shift', 'ctrl', 'alt'})
+    _variant_prefixes = ("LEFT_", "RIGHT_", "NDOF_BUTTON_")
+    _modifier_kinds = MappingProxyType({'shift':True, 'ctrl':True, 'alt':True, 'oskey':False}) # modifier -> is variant
+    _state_events = frozenset({'ON', 'OFF'})
+    _key_tables = None # (keymap events, all keys, all events)
+    
+    @classmethod
+    def _get_key_tables(cls):
+        # Built on first use rather than at import time
+        tables = cls._key_tables
+        if tables is None:
+            properties = bpy.types.KeyMapItem.bl_rna.properties
+            keymap_keys = frozenset(item.identifier for item in properties["type"].enum_items) - {'NONE'}
+            keymap_events = frozenset(item.identifier for item in properties["value"].enum_items) - {'NOTHING'}
+            tables = (keymap_events, keymap_keys | cls._modifier_keys, keymap_events | cls._state_events)
+            cls._key_tables = tables
+        return tables
     
     @classmethod
     def _iterate_key_variants(cls, key, events, invoke_key=None):
         if key == cls._invoke_key: key = invoke_key
         
-        if key not in cls._all_keys: return
+        keymap_events, all_keys, all_events = cls._get_key_tables()
+        
+        if key not in all_keys: return
         
         is_keymap = not invoke_key
         
-        all_events = (cls._keymap_events if is_keymap else cls._all_events)
+        if is_keymap: all_events = keymap_events
         
-        is_modifier = (key in cls._modifier_keys)
-        is_variant_modifier = (key in cls._variant_modifiers)
+        modifier_kind = cls._modifier_kinds.get(key)
+        is_modifier = (modifier_kind is not None)
+        is_variant_modifier = bool(modifier_kind)
         key_upper = key.upper()
+        state_events = cls._state_events
+        variant_prefixes = cls._variant_prefixes
         
-        for event in events:
-            if event not in all_events: continue
-            
-            if is_variant_modifier and (is_keymap or (event not in cls._state_events)):
-                for prefix in cls._variant_prefixes:
-                    yield f"{prefix}{key_upper}:{event}"
+        for event in all_events.intersection(events):
+            if is_variant_modifier and (is_keymap or (event not in state_events)):
+                for prefix in variant_prefixes:
+                    yield (prefix+key_upper, event)
             elif is_keymap and is_modifier:
-                yield f"{key_upper}:{event}"
+                yield (key_upper, event)
             else:
-                yield f"{key}:{event}"
+                yield (key, event)
     
     @classmethod
     def get_keys(cls, shortcut, invoke_key=None):
-        if isinstance(shortcut, str): shortcut = cls.parse(shortcut)
-        return [cls.KeyInfo(variant) for key, events in shortcut
-                for variant in cls._iterate_key_variants(key, events, invoke_key)]
+        if isinstance(shortcut, str): return list(cls._get_keys_str(shortcut, invoke_key))
+        # Variants come as (key, event) pairs, so KeyInfo doesn't need to split them
+        # (repeated variants, e.g. from "shift:PRESS, shift:PRESS", are skipped)
+        variants = dict.fromkeys(variant for key, events in shortcut
+            for variant in cls._iterate_key_variants(key, events, invoke_key))
+        return [cls.KeyInfo(variant_key, event) for variant_key, event in variants]
+    
+    @classmethod
+    def _split_keys(cls, key_infos):
+        state_infos = tuple(info for info in key_infos if info.event in cls._state_events)
+        event_infos = tuple(info for info in key_infos if info.event not in cls._state_events)
+        events_set = frozenset(info.full for info in event_infos)
+        return state_infos, event_infos, events_set
+    
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def _split_keys_str(cls, shortcut, invoke_key):
+        if isinstance(shortcut, str): return cls._split_keys(cls._get_keys_str(shortcut, invoke_key))
+        return cls._split_keys(cls.get_keys(shortcut, invoke_key))
+    
+    # Shortcut strings come from a small set of settings, so the
+    # parsed results are cached (KeyInfo objects are never modified)
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def _get_keys_str(cls, shortcut, invoke_key):
+        return tuple(cls.get_keys(cls.parse(shortcut), invoke_key))
     
     @classmethod
     def parse(cls, shortcut):
+        # The result is hashable, so it can be used as a cache key too
         result = []
         
         for part in shortcut.split(","):
             subparts = [subpart.strip() for subpart in part.split(":")]
-            result.append((subparts[0], set(subparts[1:])))
+            result.append((subparts[0], frozenset(subparts[1:])))
         
-        return result
+        return tuple(result)
 
 class ModeStack:
+    __slots__ = ("keys", "prev_state", "transitions", "__allowed_transitions", "mode", "default_mode",
+        "stack", "search_direction")
+    
     def __init__(self, keys, transitions, default_mode, mode=None, search_direction=-1):
         self.keys = keys
         self.prev_state = {}
         self.transitions = set(transitions)
+        self.__update_allowed_transitions()
         self.mode = (default_mode if mode is None else mode)
         self.default_mode = default_mode
         self.stack = [self.default_mode] # default mode should always be in the stack!
@@ -213,8 +300,10 @@ class ModeStack:
                     self.find_transition()
     
     def remove(self, name):
-        if name in self.stack:
+        try:
             self.stack.remove(name)
+        except ValueError:
+            pass
     
     def find_transition(self):
         if self.search_direction < 0:
@@ -226,19 +315,31 @@ class ModeStack:
             name = self.stack[i]
             if self.transition_allowed(self.mode, name):
                 self.mode = name
-                self.stack = self.stack[:i+1]
+                del self.stack[i+1:]
                 break
     
+    def __update_allowed_transitions(self):
+        # Transitions are symmetric, so each "mode0:mode1" is stored
+        # in both directions of a mode -> allowed modes mapping (no
+        # string concatenation is needed to check a transition)
+        allowed = {}
+        for transition in self.transitions:
+            mode0, sep, mode1 = transition.partition(":")
+            if not sep: continue
+            allowed.setdefault(mode0, set()).add(mode1)
+            allowed.setdefault(mode1, set()).add(mode0)
+        self.__allowed_transitions = allowed
+    
     def transition_allowed(self, mode0, mode1):
-        is_allowed = (mode0+":"+mode1) in self.transitions
-        is_allowed |= (mode1+":"+mode0) in self.transitions
-        return is_allowed
+        return mode1 in self.__allowed_transitions.get(mode0, ())
     
     def add_transitions(self, transitions):
         self.transitions.update(transitions)
+        self.__update_allowed_transitions()
     
     def remove_transitions(self, transitions):
         self.transitions.difference_update(transitions)
+        self.__update_allowed_transitions()
 
 class KeyMapUtils:
     @staticmethod
@@ -263,7 +364,7 @@ class KeyMapUtils:
     
     @staticmethod
     def exists(idname, place=None):
-        return bool(next(KeyMapUtils.search(idname), False))
+        return bool(next(KeyMapUtils.search(idname, place), False))
     
     @staticmethod
     def set_active(idname, active, place=None):
@@ -281,22 +382,31 @@ class KeyMapUtils:
     
     @staticmethod
     def index(km, idname):
-        for i, kmi in enumerate(km.keymap_items):
-            if kmi.idname == idname:
-                return i
-        return -1
+        return next((i for i, kmi in enumerate(km.keymap_items) if kmi.idname == idname), -1)
+    
+    __mouse_types_left = MappingProxyType({'ACTIONMOUSE':'RIGHTMOUSE', 'SELECTMOUSE':'LEFTMOUSE'})
+    __mouse_types_right = MappingProxyType({'ACTIONMOUSE':'LEFTMOUSE', 'SELECTMOUSE':'RIGHTMOUSE'})
+    
+    @staticmethod
+    def select_mouse():
+        context = bpy.context
+        userprefs = getattr(context, "preferences", None) or context.user_preferences # 2.7x: user_preferences
+        select_mouse = getattr(userprefs.inputs, "select_mouse", None)
+        if select_mouse is None: # 2.8+: it's a keyconfig preference
+            kc_prefs = context.window_manager.keyconfigs.active.preferences
+            select_mouse = getattr(kc_prefs, "select_mouse", 'RIGHT')
+        return select_mouse
+    
+    @staticmethod
+    def mouse_types_map():
+        if KeyMapUtils.select_mouse() == 'LEFT': return KeyMapUtils.__mouse_types_left
+        return KeyMapUtils.__mouse_types_right
     
     @staticmethod
-    def normalize_event_type(event_type):
-        if event_type == 'ACTIONMOUSE':
-            userprefs = bpy.context.user_preferences
-            select_mouse = userprefs.inputs.select_mouse
-            return ('RIGHTMOUSE' if select_mouse == 'LEFT' else 'LEFTMOUSE')
-        elif event_type == 'SELECTMOUSE':
-            userprefs = bpy.context.user_preferences
-            select_mouse = userprefs.inputs.select_mouse
-            return ('LEFTMOUSE' if select_mouse == 'LEFT' else 'RIGHTMOUSE')
-        return event_type
+    def normalize_event_type(event_type, mouse_types=None):
+        if (event_type != 'ACTIONMOUSE') and (event_type != 'SELECTMOUSE'): return event_type
+        if mouse_types is None: mouse_types = KeyMapUtils.mouse_types_map()
+        return mouse_types[event_type]
     
     @staticmethod
     def equal_modifiers(kmi, event, pressed_keys=[]):
@@ -307,9 +417,13 @@ class KeyMapUtils:
     
     @staticmethod
     def equal_types(kmi, event):
-        kmi_type = KeyMapUtils.normalize_event_type(kmi.type)
-        event_type = KeyMapUtils.normalize_event_type(event.type)
-        return (kmi_type == event_type)
+        kmi_type, event_type = kmi.type, event.type
+        if kmi_type == event_type: return True
+        # Preferences are read only for ACTIONMOUSE/SELECTMOUSE (at most once per comparison)
+        mouse_types = KeyMapUtils.__mouse_types_left
+        if (kmi_type not in mouse_types) and (event_type not in mouse_types): return False
+        mouse_types = KeyMapUtils.mouse_types_map()
+        return (mouse_types.get(kmi_type, kmi_type) == mouse_types.get(event_type, event_type))
     
     @staticmethod
     def equal_values(kmi, event, click='CLICK'):
@@ -322,10 +436,44 @@ class KeyMapUtils:
     @staticmethod
     def equal(kmi, event, pressed_keys=[], click='CLICK'):
         """Test if event corresponds to the given keymap item"""
-        is_equal_types = KeyMapUtils.equal_types(kmi, event)
-        is_equal_values = KeyMapUtils.equal_values(kmi, event, click)
-        is_equal_modifiers = KeyMapUtils.equal_modifiers(kmi, event, pressed_keys)
-        return is_equal_types and is_equal_values and is_equal_modifiers
+        if not KeyMapUtils.equal_types(kmi, event): return False
+        if not KeyMapUtils.equal_values(kmi, event, click): return False
+        return KeyMapUtils.equal_modifiers(kmi, event, pressed_keys)
+    
+    @staticmethod
+    def modifiers_mask(ko):
+        return int(ko.alt) | (int(ko.ctrl) << 1) | (int(ko.shift) << 2) | (int(ko.oskey) << 3)
+    
+    @staticmethod
+    def build_event_index(kmis):
+        """Group keymap items by (event type, event value, modifiers mask) for use in match()"""
+        if isinstance(kmis, bpy.types.KeyMap): kmis = kmis.keymap_items
+        index = {}
+        mouse_types = None # read from preferences only if needed
+        for kmi in kmis:
+            mask = (-1 if kmi.any else KeyMapUtils.modifiers_mask(kmi))
+            kmi_type = kmi.type
+            if kmi_type in KeyMapUtils.__mouse_types_left:
+                if mouse_types is None: mouse_types = KeyMapUtils.mouse_types_map()
+                kmi_type = mouse_types[kmi_type]
+            key = (kmi_type, kmi.value, mask)
+            index.setdefault(key, []).append(kmi)
+        return index
+    
+    @staticmethod
+    def match(index, event, pressed_keys=[], click='CLICK'):
+        """Iterate over keymap items (grouped by build_event_index()) that correspond to the given event"""
+        event_type = KeyMapUtils.normalize_event_type(event.type)
+        event_value = event.value
+        if event_value == 'CLICK': event_value = click
+        # Keymap items with 'CLICK' value are treated as having the click value
+        values = ((event_value, 'CLICK') if (event_value == click) and (click != 'CLICK') else (event_value,))
+        masks = (KeyMapUtils.modifiers_mask(event), -1)
+        for value in values:
+            for mask in masks:
+                for kmi in index.get((event_type, value, mask), ()):
+                    if (kmi.key_modifier == 'NONE') or (kmi.key_modifier in pressed_keys):
+                        yield kmi
     
     @staticmethod
     def clear(ko):
@@ -393,7 +541,11 @@ class KeyMapUtils:
         if not kmi_datas:
             return
         
-        km_items = [KeyMapUtils.serialize(kmi) for kmi in km.keymap_items]
+        # Existing items are fully serialized only if the keymap has to be
+        # rebuilt (in the append-only case, just their idnames are needed)
+        src_kmis = list(km.keymap_items)
+        src_items = [dict(idname=kmi.idname) for kmi in src_kmis]
+        km_items = list(src_items)
         
         def insertion_index(idnames, to_end):
             if "*" in idnames:
@@ -403,29 +555,72 @@ class KeyMapUtils:
                     return i
             return None
         
-        src_count = len(km.keymap_items)
-        only_append = True
+        src_count = len(src_kmis)
+        
+        anchors = set()
         for after, kmi_data, before in kmi_datas:
-            i_after = (insertion_index(after, True) if after else None)
-            i_before = (insertion_index(before, False) if before else None)
+            if after: anchors.update(after)
+            if before: anchors.update(before)
+        
+        # If insertion points don't depend on the previously inserted items,
+        # they can be found in the original list and merged in one pass
+        if ("*" not in anchors) and all((kmi_data["idname"] not in anchors) for after, kmi_data, before in kmi_datas):
+            # Each gap k (before original item k) receives items inserted right
+            # after its preceding item (each goes to the gap's front, i.e. in
+            # reverse order) and items inserted before the next item or appended
+            gaps_front = [[] for i in range(src_count+1)]
+            gaps_back = [[] for i in range(src_count+1)]
             
-            if (i_before is None) and (i_after is None):
-                i = len(km_items)
-            elif i_before is None:
-                i = i_after+1
-            elif i_after is None:
-                i = i_before
-            else:
-                i = (i_after+1 if "*" not in after else i_before)
+            first_indices = {}
+            last_indices = {}
+            for i, kmi_data in enumerate(km_items):
+                first_indices.setdefault(kmi_data["idname"], i)
+                last_indices[kmi_data["idname"]] = i
+            
+            for after, kmi_data, before in kmi_datas:
+                i_after = max((last_indices[idname] for idname in (after or ()) if idname in last_indices), default=None)
+                i_before = min((first_indices[idname] for idname in (before or ()) if idname in first_indices), default=None)
+                
+                if i_after is not None:
+                    gaps_front[i_after+1].append(kmi_data)
+                elif i_before is not None:
+                    gaps_back[i_before].append(kmi_data)
+                else:
+                    gaps_back[src_count].append(kmi_data)
             
-            only_append &= (i >= src_count)
+            only_append = not any(gaps_front[:src_count]) and not any(gaps_back[:src_count])
             
-            km_items.insert(i, kmi_data)
+            merged = []
+            for k in range(src_count+1):
+                merged.extend(reversed(gaps_front[k]))
+                merged.extend(gaps_back[k])
+                if k < src_count: merged.append(km_items[k])
+            km_items = merged
+        else:
+            only_append = True
+            for after, kmi_data, before in kmi_datas:
+                i_after = (insertion_index(after, True) if after else None)
+                i_before = (insertion_index(before, False) if before else None)
+                
+                if (i_before is None) and (i_after is None):
+                    i = len(km_items)
+                elif i_before is None:
+                    i = i_after+1
+                elif i_after is None:
+                    i = i_before
+                else:
+                    i = (i_after+1 if "*" not in after else i_before)
+                
+                only_append &= (i >= src_count)
+                
+                km_items.insert(i, kmi_data)
         
         if only_append:
             for kmi_data in km_items[src_count:]:
                 KeyMapUtils.deserialize(km, kmi_data)
         else:
+            serialized = {id(kmi_data): KeyMapUtils.serialize(kmi) for kmi_data, kmi in zip(src_items, src_kmis)}
+            km_items = [serialized.get(id(kmi_data), kmi_data) for kmi_data in km_items]
             KeyMapUtils.clear(km)
             for kmi_data in km_items:
                 KeyMapUtils.deserialize(km, kmi_data)